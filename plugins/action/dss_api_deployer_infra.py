@@ -0,0 +1,5 @@
+from ansible_collections.dataiku.dss.plugins.plugin_utils.dss_action import DssModuleActionBase
+
+
+class ActionModule(DssModuleActionBase):
+    pass
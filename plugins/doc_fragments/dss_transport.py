@@ -0,0 +1,45 @@
+class ModuleDocFragment(object):
+    # Options of the HTTP transport to the DSS API, shared by the modules using the DSS API client
+    DOCUMENTATION = r"""
+options:
+    transport:
+        type: dict
+        description:
+            - Options of the HTTP transport to the DSS API. Each option can also be set in the C(transport) of
+              connect_to, or with a DATAIKU_ANSIBLE_DSS_<OPTION> env var (ex. DATAIKU_ANSIBLE_DSS_SCHEME)
+            - The HTTP connections are kept alive and reused by all the calls of the module, so that an HTTPS
+              connection only does one TLS handshake
+            - Ignored when the task runs with the dataiku.dss.dss httpapi connection, which has its own options
+        required: false
+        suboptions:
+            scheme:
+                type: str
+                description:
+                    - The scheme of the DSS URL, http when not set
+                choices: ["http", "https"]
+            ca_bundle:
+                type: path
+                description:
+                    - A CA bundle to verify the certificate of the DSS with, instead of the system ones
+            connect_timeout:
+                type: float
+                description:
+                    - Seconds to wait for a connection to the DSS, 10 when not set
+            read_timeout:
+                type: float
+                description:
+                    - Seconds to wait for a DSS response. No timeout when not set, as some calls wait for long DSS tasks
+            retries:
+                type: int
+                description:
+                    - Retries of the idempotent calls, on connection errors and on 502, 503 and 504 statuses, 3 when not set
+            retry_backoff:
+                type: float
+                description:
+                    - Backoff factor of the retries, the delay before the Nth retry being retry_backoff * 2 ^ (N - 1),
+                      0.5 when not set
+            pool_maxsize:
+                type: int
+                description:
+                    - HTTP connections kept open to the DSS, 2 when not set
+"""
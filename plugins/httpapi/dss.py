@@ -0,0 +1,76 @@
+DOCUMENTATION = """
+---
+name: dss
+short_description: HttpApi plugin to manage Dataiku DSS through a persistent connection
+description:
+    - This plugin is used with the C(ansible.netcommon.httpapi) connection. The connection keeps
+      one authenticated, keep-alive HTTP session to a DSS for all the tasks of a play, instead of
+      a new client and a new TCP connection per task.
+    - The modules of this collection send their DSS API calls through this connection when they
+      are run with it. The DSS API key is the password of the connection, C(ansible_httpapi_password),
+      or its user when no password is set.
+
+author:
+    - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
+"""
+
+EXAMPLES = """
+# cat inventory.yml
+all:
+  hosts:
+    dss:
+      ansible_host: dss.example.com
+      ansible_connection: ansible.netcommon.httpapi
+      ansible_network_os: dataiku.dss.dss
+      ansible_httpapi_port: 10000
+      ansible_httpapi_use_ssl: false
+      ansible_httpapi_password: "{{ dss_api_key }}"
+"""
+
+import base64
+
+from ansible.module_utils.common.collections import Mapping
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible.plugins.httpapi import HttpApiBase
+
+
+class HttpApi(HttpApiBase):
+    def login(self, username, password):
+        # DSS API keys are sent as the user of a basic authentication, without password
+        api_key = password or username
+        if api_key:
+            credentials = base64.b64encode(to_bytes(f"{api_key}:")).decode("ascii")
+            self.connection._auth = {"Authorization": f"Basic {credentials}"}
+
+    def logout(self):
+        self.connection._auth = None
+
+    def update_auth(self, response, response_text):
+        # The API key is sent with every request, the cookies set by DSS must not replace it
+        return None
+
+    def handle_httperror(self, exc):
+        # DSS errors are given back to the module, which raises them like the DSS API client does
+        return exc
+
+    def send_request(self, data, method="GET", path="/", params=None, headers=None):
+        query = _encode_params(params or {})
+        if query:
+            path = f"{path}{'&' if '?' in path else '?'}{query}"
+        response, response_data = self.connection.send(path, data, method=method, headers=headers or {})
+        return {
+            "status_code": response.getcode(),
+            "headers": dict(response.headers.items()) if response.headers is not None else {},
+            "text": to_text(response_data.getvalue()),
+        }
+
+
+def _encode_params(params):
+    # Encodes the query parameters like requests does, which does not send the parameters set to None
+    pairs = []
+    for key, values in params.items() if isinstance(params, Mapping) else params:
+        if isinstance(values, (str, bytes)) or not hasattr(values, "__iter__"):
+            values = [values]
+        pairs.extend((key, value) for value in values if value is not None)
+    return urlencode(pairs)
@@ -14,38 +14,235 @@ description: |
 
     ---
     plugin: dataiku.dss.fm_dss
+    status_concurrency: 10
+    fm_concurrency: 4
+    cache: true
+    cache_plugin: ansible.builtin.jsonfile
+    cache_connection: ~/.cache/dataiku/fm_dss
+    cache_timeout: 600
+    incremental_refresh: true
+    status_ttl: 3600
     dataiku_fleet_managers:
     - id: <NAME>
       host: <HTTPS_HOST>
+      tenant_ids: # Default to [main]
+        - main
       instances:
         access_type: public_ip
         ssh:
           user: <DSS_SSH_USER>
-        tags:
+          tuning: # Optional, SSH settings set on the vnet groups
+            control_persist: 10m # Optional, replaces the one of the ssh args, empty to disable the multiplexing
+            pipelining: true # Default true
+            address_family: inet # Optional, inet, inet6 or any
+          vnets_tuning: # Optional, overrides of the tuning per vnet label
+            <VNET_LABEL>:
+              address_family: inet6
+        required_fm_tags:
           - production
+        filters: # All optional, evaluated before querying the instances statuses
+          node_types: [automation]
+          excluded_node_types: [design]
+          vnets: [<VNET_LABEL>]
+          label_regex: "^prod-"
+          image_ids: [<IMAGE_ID>]
+          templates: [<INSTANCE_SETTINGS_TEMPLATE_LABEL>]
+        dss_port: 10000 # Default DSS port, when the template does not change it
+        dss_datadir: /data/dataiku/dss_data # DSS data dir of the instances
       api_key:
         file: "~/.config/dataiku/<NAME>.json"
         ssh_auto_create: true
+        validate: true # Check the key from the file before using it, default true
       ssh:
         user: <FM_SSH_USER> # Ex: ec2-user
         host: <SSH_HOST> # Default to same than HTTPS if absent
         fm_user: <USER_NAME_IN_FM> # A FM user is required to have a key
+        control_persist: 60s # Lifetime of the shared ssh connection
+
+    The instances can be filtered on their FM tags, DSS node type, vnet label, label,
+    image and instance settings template label. These filters are evaluated on the
+    instances listing, so excluded instances do not cost a status request.
+
+    The API keys of all the Fleet Managers to query are resolved in parallel before any
+    tenant is queried. A key read from a file is checked with one request first; when it
+    is rejected and O(ssh_auto_create) is set, a new key is created through ssh, reusing
+    a shared ssh connection (ControlMaster).
+
+    The instance settings templates of each tenant are fetched once. The C(dataiku.dss.port)
+    host var comes from the enabled C(UPDATE_DSS_PORT) setup action of the instance template,
+    or C(instances.dss_port) otherwise. FM templates do not change the DSS data dir, so
+    C(dataiku.dss.datadir) is C(instances.dss_datadir).
+
+    A Fleet Manager can hold several tenants, list them with O(tenant_ids) instead of
+    O(tenant_id). All the tenants are queried in parallel and each of them gets its
+    own C(fm-<id>-<tenant>) group. A tenant that cannot be queried is reported and skipped.
+
+    When the cache is enabled, the data fetched from each Fleet Manager tenant is stored
+    under its own cache key and reused until it is older than O(cache_timeout). With
+    O(incremental_refresh), an expired tenant is refreshed by listing its instances again
+    but only the statuses of the changed or outdated instances are queried. The statuses
+    are kept for that under another key of the cache plugin, which never expires.
+
+    With C(instances.ssh.tuning), the SSH connections to the instances are tuned through
+    vnet group vars, built from the settings of the ssh connection plugin in ansible.cfg or
+    the environment. The address family is added to their C(ssh_extra_args) in
+    C(ansible_ssh_extra_args). ssh keeps the first value of an option and the C(ssh_args) come
+    first, so a C(control_persist) different from the one of the C(ssh_args) (60s by default)
+    replaces their ControlMaster and ControlPersist options in C(ansible_ssh_args).
+    C(ansible_pipelining) is set too. C(ssh_common_args), where a bastion ProxyJump is usually
+    set, are never changed. Like any group vars, these are overridden by the same vars set on
+    the hosts or on child groups. C(instances.ssh.vnets_tuning) overrides the tuning for some vnets.
+
+    With O(probe_dss), the DSS of the hosts are probed in parallel once the inventory is built,
+    so that plays can target the reachable nodes without gathering facts first.
+
+    Statistics of the inventory build are logged at the end of the parse, and written to
+    O(stats_file) when it is set, to tell apart a slow Fleet Manager from a slow plugin.
+
+options:
+    plugin:
+        description: Token that ensures this is a source file for the plugin.
+        required: true
+        choices: ["dataiku.dss.fm_dss", "fm_dss"]
+    dataiku_fleet_managers:
+        description: List of the Fleet Managers to query, see the example above for the expected attributes.
+        type: list
+        elements: dict
+        default: []
+    status_concurrency:
+        description:
+            - Maximum number of instance status requests sent in parallel to a Fleet Manager.
+            - Hosts are still added to the inventory in the order of the Fleet Manager instances listing.
+        type: int
+        default: 10
+    fm_concurrency:
+        description:
+            - Maximum number of Fleet Manager tenants queried in parallel.
+            - Each tenant uses its own pool of O(status_concurrency) workers for the instance statuses.
+        type: int
+        default: 4
+    cache_force_refresh:
+        description:
+            - Ignore the cached Fleet Manager data and query every Fleet Manager again. The cache is updated with the new data.
+        type: bool
+        default: false
+        env:
+            - name: DATAIKU_FM_DSS_CACHE_FORCE_REFRESH
+    connect_timeout:
+        description: Timeout in seconds to establish a connection to a Fleet Manager.
+        type: float
+        default: 10
+    read_timeout:
+        description: Timeout in seconds to wait for a Fleet Manager response.
+        type: float
+        default: 60
+    request_retries:
+        description:
+            - Number of retries of a failed request to a Fleet Manager, on connection errors and 429, 500, 502, 503 and 504 responses.
+        type: int
+        default: 3
+    request_backoff_factor:
+        description:
+            - Factor of the exponential backoff between two retries, the n-th retry waits C(request_backoff_factor * 2^(n-1)) seconds.
+        type: float
+        default: 0.5
+    strict:
+        description:
+            - Fail the inventory when a tenant or an instance status cannot be fetched.
+            - By default, the inventory is built from what could be fetched and a summary of the failures is logged.
+        type: bool
+        default: false
+    incremental_refresh:
+        description:
+            - When the cached data of a tenant has expired, only query the status of the instances whose definition
+              (label, image, template, tags and vnet) changed or whose cached status is older than O(status_ttl).
+            - Requires the cache to be enabled.
+        type: bool
+        default: false
+    status_ttl:
+        description:
+            - Maximum age in seconds of an instance status reused by an incremental refresh.
+        type: int
+        default: 3600
+    stream_instances:
+        description:
+            - Parse the instances listing of a tenant while it is received, instead of loading the whole response.
+            - Only the fields used by the plugin are kept for each instance, and the status requests are sent as soon as
+              an instance is parsed. This keeps the memory low and starts the status requests earlier on large tenants.
+        type: bool
+        default: false
+    compact_host_vars:
+        description:
+            - Set the values shared by many hosts once, on groups, instead of a full C(dataiku) dict on every host.
+            - The DSS port and datadir are set on C(fm-<id>-<tenant>-template-<template label>) groups, the node type on
+              C(fm-<id>-<tenant>-node-type-<node type>) groups and the image on C(fm-<id>-<tenant>-image-<image id>) groups.
+              Hosts only hold C(ansible_host), C(dataiku_dss_node_id) and C(dataiku_dss_logical_instance_id).
+            - The C(dataiku) variable is still available, it is set on the tenant group and templated from these variables.
+        type: bool
+        default: false
+    probe_dss:
+        description:
+            - Probe the DSS of every host added to the inventory, to know if it is reachable and its version.
+            - Sets the C(dataiku_dss_reachable), C(dataiku_dss_version) and C(dataiku_dss_probed_node_type) host vars,
+              and adds the unreachable hosts to the C(fm-<id>-<tenant>-unreachable) group.
+            - A DSS is reachable when it answers its configuration. An error status or another body, like the error page
+              of the nginx in front of a DSS that is down, makes it unreachable.
+            - The probes are never cached.
+        type: bool
+        default: false
+    probe_concurrency:
+        description: Maximum number of DSS probed in parallel.
+        type: int
+        default: 20
+    probe_timeout:
+        description: Timeout in seconds of a DSS probe, to connect and to get the response.
+        type: float
+        default: 3
+    probe_scheme:
+        description: Scheme used to probe the DSS.
+        type: str
+        choices: ["http", "https"]
+        default: http
+    probe_validate_certs:
+        description: Validate the certificate of the DSS when they are probed with https.
+        type: bool
+        default: true
+    stats_file:
+        description:
+            - Path of a JSON file where the statistics of the inventory build are written.
+            - The statistics are always logged. They hold, per FM and tenant, the number of requests, the latency
+              percentiles and the bytes received per endpoint, and the number of instances seen, filtered, skipped and added.
+        type: path
+
+extends_documentation_fragment:
+    - inventory_cache
 
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
 
-from ansible.errors import AnsibleError
-from ansible.plugins.inventory import BaseInventoryPlugin
+from ansible import constants as C
+from ansible.errors import AnsibleError, AnsibleParserError
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, get_cache_plugin
+from ansible.plugins.loader import connection_loader
 from ansible_collections.dataiku.dss.plugins.module_utils.utils import makeSimpleLogger
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
+import re
+import shlex
 import subprocess
+import codecs
 import json
 import stat
+import threading
+import time
 
 try:
     from requests import Session
+    from requests.adapters import HTTPAdapter
     from requests.auth import HTTPBasicAuth
+    from urllib3.util.retry import Retry
 except ImportError as import_error:
     REQUESTS_IMPORT_ERROR = import_error
 else:
@@ -53,8 +250,86 @@ else:
 
 logger = makeSimpleLogger(__name__)
 
+DEFAULT_DSS_PORT = "10000"
+DEFAULT_DSS_DATADIR = "/data/dataiku/dss_data"
+# Host var of the compact mode, set once per tenant and resolved from the host and group vars
+COMPACT_DATAIKU_VARIABLE = {
+    "dss": {
+        "image_id": "{{ dataiku_dss_image_id }}",
+        "port": "{{ dataiku_dss_port }}",
+        "datadir": "{{ dataiku_dss_datadir }}",
+        "node_id": "{{ dataiku_dss_node_id }}",
+        "node_type": "{{ dataiku_dss_node_type }}",
+        "logical_instance_id": "{{ dataiku_dss_logical_instance_id }}",
+    }
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS_REGEX = re.compile(r"[\s,]*")
+# Fields of the instances listing used by the plugin, the only ones kept when the listing is streamed
+INSTANCE_FIELDS = [
+    "id", "label", "virtualNetworkId", "virtualNetworkLabel", "instanceSettingsTemplateId",
+    "instanceSettingsTemplateLabel", "imageId", "dssNodeType", "fmTags",
+]
 
-class InventoryModule(BaseInventoryPlugin):
+
+class _TenantStats(object):
+    """Statistics of the inventory build for one tenant of a FM, requests are recorded from several threads."""
+
+    def __init__(self, fm_id, tenant_id):
+        self.fm_id = fm_id
+        self.tenant_id = tenant_id
+        self.source = "none"
+        self.requests = {}
+        self.instances_seen = 0
+        self.instances_filtered = 0
+        self.instances_skipped = 0
+        self.instances_down = 0
+        self.hosts_added = 0
+        self.statuses_reused = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, endpoint, duration, size, failed=False):
+        with self._lock:
+            endpoint_stats = self.requests.setdefault(endpoint, {"durations": [], "bytes": 0, "failed": 0})
+            endpoint_stats["durations"].append(duration)
+            endpoint_stats["bytes"] += size
+            if failed:
+                endpoint_stats["failed"] += 1
+
+    @staticmethod
+    def _percentile(sorted_values, percentile):
+        # Nearest-rank percentile
+        index = max(0, -(-len(sorted_values) * percentile // 100) - 1)
+        return round(sorted_values[int(index)], 4)
+
+    def to_dict(self):
+        requests = {}
+        for endpoint, endpoint_stats in self.requests.items():
+            durations = sorted(endpoint_stats["durations"])
+            requests[endpoint] = {
+                "count": len(durations),
+                "failed": endpoint_stats["failed"],
+                "bytes": endpoint_stats["bytes"],
+                "latency_p50_s": self._percentile(durations, 50),
+                "latency_p90_s": self._percentile(durations, 90),
+                "latency_p99_s": self._percentile(durations, 99),
+                "latency_max_s": round(durations[-1], 4),
+            }
+        return {
+            "fm_id": self.fm_id,
+            "tenant_id": self.tenant_id,
+            "source": self.source,
+            "requests": requests,
+            "instances_seen": self.instances_seen,
+            "instances_filtered": self.instances_filtered,
+            "instances_skipped": self.instances_skipped,
+            "instances_down": self.instances_down,
+            "hosts_added": self.hosts_added,
+            "statuses_reused": self.statuses_reused,
+        }
+
+
+class InventoryModule(BaseInventoryPlugin, Cacheable):
     NAME = "fm_dss"
 
     def __init__(self):
@@ -63,185 +338,735 @@ class InventoryModule(BaseInventoryPlugin):
         else:
             super(InventoryModule, self).__init__()
 
-    def parse(self, inventory, loader, path, cache=False):
+    def parse(self, inventory, loader, path, cache=True):
+        parse_start = time.perf_counter()
+        self._stats = {}
         try:
             super(InventoryModule, self).parse(inventory, loader, path, cache)
-            fleet_managers_config = loader.load_from_file(path)
-            for fleet_manager in fleet_managers_config.get(
-                "dataiku_fleet_managers", []
-            ):
+            self._read_config_data(path)
+
+            # The cache is read unless it is disabled, explicitly refreshed, or if the inventory is being refreshed
+            cache_enabled = self.get_option("cache")
+            force_refresh = self.get_option("cache_force_refresh")
+            read_cache = cache_enabled and cache and not force_refresh
+            incremental_refresh = cache_enabled and self.get_option("incremental_refresh") and not force_refresh
+            cache_key_prefix = self.get_cache_key(path)
+            refresh_cache = self._get_refresh_cache() if incremental_refresh else None
+
+            tenants = []
+            for fleet_manager in self.get_option("dataiku_fleet_managers"):
                 fm_id = fleet_manager["id"]
-                host = fleet_manager["host"]
-                port = str(fleet_manager.get("port", "443"))
-                protocol = fleet_manager.get("protocol", "https")
-                tenant_id = fleet_manager.get("tenant_id", "main")
-
-                # Find API key
-                api_key_config = fleet_manager["api_key"]
-                api_key_id = None
-                api_key_secret = None
-                if "file" in api_key_config:
-                    file_path = os.path.expanduser(api_key_config["file"])
-                    if not os.path.exists(file_path) and api_key_config.get(
-                        "ssh_auto_create", False
-                    ):
-                        ssh_user = fleet_manager["ssh"]["user"]
-                        ssh_host = fleet_manager["ssh"].get("host", host)
-                        ssh_fm_unix_user = fleet_manager["ssh"].get(
-                            "fm_unix_user", "dataiku"
-                        )
-                        ssh_fm_user = fleet_manager["ssh"].get("fm_user", "admin")
-                        ssh_fm_datadir = fleet_manager["ssh"].get(
-                            "datadir", "/data/dataiku/fmhome"
-                        )
-                        ssh_command = [
-                            "ssh",
-                            "-o",
-                            "StrictHostKeyChecking=no",
-                            "-o",
-                            "BatchMode=yes",
-                            "-o",
-                            f"User={ssh_user}",
-                            ssh_host,
-                        ]
-                        command = [
-                            f"{ssh_fm_datadir}/bin/fmadmin",
-                            "create-personal-api-key",
-                            ssh_fm_user,
-                        ]
-                        if ssh_fm_unix_user != ssh_user:
-                            command = ["sudo", "-u", ssh_fm_unix_user] + command
-                        ssh_process = subprocess.Popen(
-                            ssh_command + command,
-                            shell=False,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            stdin=subprocess.PIPE,
-                            close_fds=True,
-                        )
-                        stdout, stderr = ssh_process.communicate()
-                        if ssh_process.returncode != 0:
-                            raise Exception(
-                                f"Failed to execute ssh command. stdout={stdout} stderr={stderr}"
-                            )
-                        id = None
-                        secret = None
-                        for line in reversed(stdout.decode().splitlines()):
-                            if line.startswith("Key id: "):
-                                id = line[8:]
-                            if line.startswith("Key secret: "):
-                                secret = line[12:]
-                            if id is not None and secret is not None:
-                                break
-                        api_key_id = id
-                        api_key_secret = secret
-                        with open(file_path, "w") as file:
-                            json.dump({"id": id, "secret": secret}, file, indent=2)
-                        os.chmod(file_path, stat.S_IRUSR | stat.S_IWUSR)
-                    else:
-                        with open(file_path, "r") as file:
-                            api_key_data = json.load(file)
-                            api_key_id = api_key_data["id"]
-                            api_key_secret = api_key_data["secret"]
-                elif "aws_secret_manager" in api_key_config:
-                    logger.fatal("aws_secret_manager fetch method not implemented.")
-                elif "azure_vault" in api_key_config:
-                    logger.fatal("azure_vault fetch method not implemented.")
-                elif "gcp_secret_manager" in api_key_config:
-                    logger.fatal("gcp_secret_manager fetch method not implemented.")
-
-                # Get list of instances
-                session = Session()
+                for tenant_id in self._get_tenant_ids(fleet_manager):
+                    cache_key = f"{cache_key_prefix}_{fm_id}_{tenant_id}"
+                    tenant_data = None
+                    previous_data = None
+                    self._stats[(fm_id, tenant_id)] = _TenantStats(fm_id, tenant_id)
+                    if read_cache:
+                        tenant_data = self._get_cached_tenant_data(cache_key, fleet_manager["instances"])
+                        if tenant_data is not None:
+                            logger.info("Using cached data for tenant %s of FM %s", tenant_id, fm_id)
+                            self._stats[(fm_id, tenant_id)].source = "cache"
+                    if tenant_data is None and incremental_refresh:
+                        previous_data = refresh_cache.get(f"{cache_key}_statuses")
+                    tenants.append((fleet_manager, tenant_id, cache_key, tenant_data, previous_data))
+
+            # Get a working API key for all the FMs to query at once, before querying their tenants
+            fleet_managers_to_fetch = {}
+            tenant_ids_to_fetch = {}
+            for fleet_manager, tenant_id, cache_key, tenant_data, previous_data in tenants:
+                if tenant_data is None:
+                    fleet_managers_to_fetch.setdefault(fleet_manager["id"], fleet_manager)
+                    tenant_ids_to_fetch.setdefault(fleet_manager["id"], []).append(tenant_id)
+            self._fm_sessions = {}
+            self._prefetched_vnets = {}
+            fm_errors = {}
+            with ThreadPoolExecutor(max_workers=max(1, self.get_option("fm_concurrency"))) as executor:
+                session_futures = {
+                    fm_id: executor.submit(self._provision_fm_session, fleet_manager, tenant_ids_to_fetch[fm_id])
+                    for fm_id, fleet_manager in fleet_managers_to_fetch.items()
+                }
+            for fm_id, future in session_futures.items():
+                try:
+                    self._fm_sessions[fm_id] = future.result()
+                except Exception as e:
+                    logger.error("Failed to get an API key for FM %s: %s", fm_id, e, exc_info=True)
+                    fm_errors[fm_id] = e
+
+            # Query all the FMs and tenants missing from the cache at once
+            with ThreadPoolExecutor(max_workers=max(1, self.get_option("fm_concurrency"))) as executor:
+                futures = {}
+                for fleet_manager, tenant_id, cache_key, tenant_data, previous_data in tenants:
+                    if tenant_data is None and fleet_manager["id"] in self._fm_sessions:
+                        futures[cache_key] = executor.submit(self._fetch_tenant_data, fleet_manager, tenant_id, previous_data)
+
+            # Merge the results in the configuration order, a failing tenant does not prevent the others to be added
+            failed_tenants = []
+            missing_statuses = 0
+            self._probe_targets = []
+            for fleet_manager, tenant_id, cache_key, tenant_data, previous_data in tenants:
+                if tenant_data is None:
+                    if fleet_manager["id"] in fm_errors:
+                        failed_tenants.append(f"{fleet_manager['id']}/{tenant_id}")
+                        self._stats[(fleet_manager["id"], tenant_id)].source = "failed"
+                        continue
+                    try:
+                        tenant_data = futures[cache_key].result()
+                    except Exception as e:
+                        logger.error("Failed to fetch tenant %s of FM %s: %s", tenant_id, fleet_manager["id"], e, exc_info=True)
+                        failed_tenants.append(f"{fleet_manager['id']}/{tenant_id}")
+                        self._stats[(fleet_manager["id"], tenant_id)].source = "failed"
+                        continue
+                    if cache_enabled:
+                        self._cache[cache_key] = tenant_data
+                    if incremental_refresh:
+                        refresh_cache[f"{cache_key}_statuses"] = {"statuses": tenant_data["statuses"]}
+                missing_statuses += self._populate_tenant(fleet_manager["id"], tenant_id, fleet_manager["instances"], tenant_data)
+
+            if refresh_cache is not None:
+                refresh_cache.update_cache_if_changed()
+
+            if self.get_option("probe_dss"):
+                self._probe_dss_nodes()
+
+            if failed_tenants or missing_statuses:
+                summary = (
+                    f"Partial inventory: {len(tenants) - len(failed_tenants)}/{len(tenants)} tenants fetched, "
+                    f"{missing_statuses} instances skipped because their status could not be fetched. "
+                    f"Failed tenants: {', '.join(failed_tenants) or 'none'}"
+                )
+                if self.get_option("strict"):
+                    raise AnsibleParserError(summary)
+                logger.warning(summary)
+        except AnsibleParserError:
+            raise
+        except Exception as e:
+            logger.error(e, exc_info=True)
+        finally:
+            self._report_stats(time.perf_counter() - parse_start)
+
+    def _report_stats(self, parse_time):
+        stats = {
+            "parse_time_s": round(parse_time, 3),
+            "tenants": [tenant_stats.to_dict() for tenant_stats in self._stats.values()],
+        }
+        logger.info("Inventory build statistics: %s", json.dumps(stats))
+        stats_file = self.get_option("stats_file")
+        if stats_file:
+            try:
+                with open(stats_file, "w") as file:
+                    json.dump(stats, file, indent=2)
+            except Exception as e:
+                logger.warning("Failed to write the inventory build statistics to %s: %s", stats_file, e)
+
+    @staticmethod
+    def _get_tenant_ids(fleet_manager):
+        if "tenant_ids" in fleet_manager:
+            if not fleet_manager["tenant_ids"]:
+                raise AnsibleParserError(f"The tenant_ids of FM {fleet_manager['id']} must not be empty")
+            return fleet_manager["tenant_ids"]
+        return [fleet_manager.get("tenant_id", "main")]
+
+    def _provision_fm_session(self, fleet_manager, tenant_ids):
+        # Tenants of the same FM share their session, and the API key is only resolved once. tenant_ids are the tenants
+        # of the FM to fetch, the ones served from the cache do not need the session
+        api_key_config = fleet_manager["api_key"]
+        api_key_id, api_key_secret, created = self._get_api_key(fleet_manager)
+
+        # Enough pooled connections for all the tenants of this FM fetched at the same time
+        concurrent_tenants = min(max(1, len(tenant_ids)), max(1, self.get_option("fm_concurrency")))
+        session = self._build_session(
+            api_key_id, api_key_secret, concurrent_tenants * max(1, self.get_option("status_concurrency"))
+        )
+
+        # A key read from a file may have been revoked, it is rotated once here rather than failing every tenant
+        if tenant_ids and not created and "file" in api_key_config and api_key_config.get("validate", True):
+            if not self._validate_api_key(session, fleet_manager, tenant_ids[0]):
+                file_path = os.path.expanduser(api_key_config["file"])
+                if not api_key_config.get("ssh_auto_create", False):
+                    raise AnsibleError(f"The API key from {file_path} was rejected by FM {fleet_manager['id']}")
+                logger.warning("The API key from %s was rejected by FM %s, creating a new one.", file_path, fleet_manager["id"])
+                api_key_id, api_key_secret = self._create_api_key_with_ssh(fleet_manager, file_path)
                 session.auth = HTTPBasicAuth(api_key_id, api_key_secret)
-                instances_config = fleet_manager["instances"]
-                network_access = instances_config.get("access_type", "public_ip")
-                instance_ssh_user = instances_config["ssh"]["user"]
-                required_fm_tags = instances_config.get("required_fm_tags", [])
-
-                # Get vnets
-                request = session.request(
-                    "GET",
-                    f"{protocol}://{host}:{port}/api/public/tenants/{tenant_id}/virtual-networks",
+        return session
+
+    def _validate_api_key(self, session, fleet_manager, tenant_id):
+        # The vnets of a tenant to fetch are used as the check, and kept so that they are not requested again
+        protocol = fleet_manager.get("protocol", "https")
+        port = str(fleet_manager.get("port", "443"))
+        start = time.perf_counter()
+        response = session.request(
+            "GET",
+            f"{protocol}://{fleet_manager['host']}:{port}/api/public/tenants/{tenant_id}/virtual-networks",
+            timeout=(self.get_option("connect_timeout"), self.get_option("read_timeout")),
+        )
+        self._stats[(fleet_manager["id"], tenant_id)].record_request(
+            "virtual-networks", time.perf_counter() - start, len(response.content)
+        )
+        if response.status_code in (401, 403):
+            return False
+        response.raise_for_status()
+        self._prefetched_vnets[(fleet_manager["id"], tenant_id)] = response.json()
+        return True
+
+    def _probe_dss_nodes(self):
+        # Liveness is never cached, all the hosts are probed at each parse with a bounded pool and no retry
+        probe_concurrency = max(1, self.get_option("probe_concurrency"))
+        scheme = self.get_option("probe_scheme")
+        session = Session()
+        session.verify = self.get_option("probe_validate_certs")
+        adapter = HTTPAdapter(pool_connections=probe_concurrency, pool_maxsize=1, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        def probe(target):
+            fm_id, tenant_id, inventory_host, ansible_host, port = target
+            url = f"{scheme}://{ansible_host}:{port}/dip/api/get-configuration"
+            start = time.perf_counter()
+            try:
+                response = session.request("GET", url, timeout=self.get_option("probe_timeout"))
+            except Exception as e:
+                self._stats[(fm_id, tenant_id)].record_request("dss-probe", time.perf_counter() - start, 0, failed=True)
+                logger.warning("DSS of %s is unreachable: %s", inventory_host.name, e)
+                return None
+            configuration = None
+            if 200 <= response.status_code < 300:
+                try:
+                    configuration = response.json()
+                except ValueError:
+                    pass
+            # A DSS that is down behind its nginx front answers with an error page instead of its configuration
+            reachable = isinstance(configuration, dict) and "version" in configuration
+            self._stats[(fm_id, tenant_id)].record_request(
+                "dss-probe", time.perf_counter() - start, len(response.content), failed=not reachable
+            )
+            if not reachable:
+                logger.warning("DSS of %s did not answer its configuration (HTTP %s)", inventory_host.name, response.status_code)
+                return None
+            return configuration
+
+        with ThreadPoolExecutor(max_workers=probe_concurrency) as executor:
+            results = list(executor.map(probe, self._probe_targets))
+
+        for (fm_id, tenant_id, inventory_host, ansible_host, port), configuration in zip(self._probe_targets, results):
+            inventory_host.set_variable("dataiku_dss_reachable", configuration is not None)
+            if configuration is None:
+                group_name = f"fm-{fm_id}-{tenant_id}-unreachable"
+                self.inventory.add_group(group_name)
+                self.inventory.groups[group_name].add_host(inventory_host)
+                continue
+            version = configuration.get("version")
+            if isinstance(version, dict):
+                version = version.get("product_version")
+            inventory_host.set_variable("dataiku_dss_version", version)
+            inventory_host.set_variable("dataiku_dss_probed_node_type", configuration.get("nodeType"))
+
+    def _build_session(self, api_key_id, api_key_secret, pool_size):
+        # Only idempotent requests are sent to the FM, so they can all be retried
+        retry = Retry(
+            total=self.get_option("request_retries"),
+            backoff_factor=self.get_option("request_backoff_factor"),
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = Session()
+        session.auth = HTTPBasicAuth(api_key_id, api_key_secret)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _get_json(self, session, url, stats=None, endpoint=None):
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                "GET", url, timeout=(self.get_option("connect_timeout"), self.get_option("read_timeout"))
+            )
+        except Exception:
+            if stats is not None:
+                stats.record_request(endpoint, time.perf_counter() - start, 0, failed=True)
+            raise
+        if stats is not None:
+            stats.record_request(endpoint, time.perf_counter() - start, len(response.content), failed=not response.ok)
+        response.raise_for_status()
+        return response.json()
+
+    def _iter_json_array(self, session, url, stats=None, endpoint=None):
+        # Yields the items of a JSON array response as they are received, without loading the whole response
+        start = time.perf_counter()
+        size = 0
+        failed = True
+        try:
+            with session.request(
+                "GET", url, stream=True, timeout=(self.get_option("connect_timeout"), self.get_option("read_timeout"))
+            ) as response:
+                response.raise_for_status()
+                decoder = json.JSONDecoder()
+                text_decoder = codecs.getincrementaldecoder(response.encoding or "UTF-8")()
+                buffer = ""
+                array_started = False
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    buffer += text_decoder.decode(chunk)
+                    position = 0
+                    while True:
+                        position = JSON_SEPARATORS_REGEX.match(buffer, position).end()
+                        if position == len(buffer):
+                            break
+                        if not array_started:
+                            if buffer[position] != "[":
+                                raise ValueError(f"Expected a JSON array from {url}")
+                            array_started = True
+                            position += 1
+                            continue
+                        if buffer[position] == "]":
+                            failed = False
+                            return
+                        try:
+                            item, position = decoder.raw_decode(buffer, position)
+                        except ValueError:
+                            # The item is not complete yet
+                            break
+                        yield item
+                    buffer = buffer[position:]
+                raise ValueError(f"Truncated JSON array from {url}")
+        finally:
+            if stats is not None:
+                stats.record_request(endpoint, time.perf_counter() - start, size, failed=failed)
+
+    def _get_refresh_cache(self):
+        """Returns the cache of the statuses reused by the incremental refreshes
+
+        It uses the cache plugin of the inventory without timeout, as the statuses are needed once the data of their
+        tenant has expired. Instances whose status is too old are queried again, see the status_ttl option.
+        """
+        if getattr(self, "_refresh_cache", None) is None:
+            cache_options = {"_timeout": 0}
+            if self.get_option("cache_connection") is not None:
+                cache_options["_uri"] = self.get_option("cache_connection")
+            if self.get_option("cache_prefix") is not None:
+                cache_options["_prefix"] = self.get_option("cache_prefix")
+            self._refresh_cache = get_cache_plugin(self.get_option("cache_plugin"), **cache_options)
+        return self._refresh_cache
+
+    def _get_cached_tenant_data(self, cache_key, instances_config):
+        try:
+            tenant_data = self._cache[cache_key]
+        except KeyError:
+            return None
+
+        # Some cache plugins never expire their content, so the age is also checked here. A timeout of 0 never expires
+        cache_timeout = self.get_option("cache_timeout")
+        if cache_timeout and time.time() - tenant_data.get("fetched_at", 0) > cache_timeout:
+            return None
+
+        # The filters may have changed since the data was cached
+        statuses = tenant_data.get("statuses", {})
+        for instance in self._select_instances(tenant_data.get("instances", []), instances_config):
+            if instance["id"] not in statuses:
+                return None
+        return tenant_data
+
+    def _fetch_tenant_data(self, fleet_manager, tenant_id, previous_data=None):
+        host = fleet_manager["host"]
+        port = str(fleet_manager.get("port", "443"))
+        protocol = fleet_manager.get("protocol", "https")
+        tenant_url = f"{protocol}://{host}:{port}/api/public/tenants/{tenant_id}"
+        status_concurrency = max(1, self.get_option("status_concurrency"))
+
+        session = self._fm_sessions[fleet_manager["id"]]
+        stats = self._stats[(fleet_manager["id"], tenant_id)]
+        stats.source = "incremental" if previous_data else "fetched"
+
+        fetched_at = time.time()
+
+        # Get vnets
+        vnets = self._prefetched_vnets.pop((fleet_manager["id"], tenant_id), None)
+        if vnets is None:
+            vnets = self._get_json(session, f"{tenant_url}/virtual-networks", stats, "virtual-networks")
+
+        # Get instance templates, once per tenant, to know the DSS settings of the instances created from them
+        try:
+            templates_list = self._get_json(
+                session, f"{tenant_url}/instance-settings-templates", stats, "instance-settings-templates"
+            )
+            templates = {template["id"]: self._get_template_settings(template) for template in templates_list}
+        except Exception as e:
+            logger.warning(
+                "Failed to fetch the instance settings templates of tenant %s of FM %s, default DSS settings are used: %s",
+                tenant_id, fleet_manager["id"], e
+            )
+            templates = {}
+
+        # Physical instance info, only for the instances matching the filters. On an incremental refresh,
+        # the previous status of an instance is kept if its definition did not change and it is recent enough.
+        # Status requests are sent while the instances are listed, which matters when the listing is streamed
+        previous_statuses = previous_data.get("statuses", {}) if previous_data else {}
+        status_ttl = self.get_option("status_ttl")
+        get_skip_reason = self._build_instance_filter(fleet_manager["instances"])
+        instances = []
+        statuses = {}
+        pending_statuses = []
+        with ThreadPoolExecutor(max_workers=status_concurrency) as executor:
+            if self.get_option("stream_instances"):
+                instances_listing = (
+                    self._get_compact_instance(instance)
+                    for instance in self._iter_json_array(session, f"{tenant_url}/instances", stats, "instances")
                 )
-                request.raise_for_status()
-                vnets_list = request.json()
-                vnets = {}
-                vnets_inventory = {}
-                inventory.add_group(f"fm-{fm_id}-{tenant_id}")
-                tenant_group = inventory.groups[f"fm-{fm_id}-{tenant_id}"]
-                for vnet in vnets_list:
-                    vnets[vnet["id"]] = vnet
-                    group_name = f"fm-{fm_id}-{tenant_id}-{vnet['label']}"
-                    inventory.add_group(group_name)
-                    vnet_group = inventory.groups[group_name]
-                    tenant_group.add_child_group(vnet_group)
-                    vnets_inventory[vnet["id"]] = vnet_group
-
-                # Get instance templates
-                # request = session.request("GET",f"{protocol}://{host}:{port}/api/public/tenants/{tenant_id}/instance-settings-templates")
-                # request.raise_for_status()
-                # templates_list = request.json()
-                # templates = { t["id"]: t for t in templates_list }
-
-                # Get instances
-                request = session.request(
-                    "GET",
-                    f"{protocol}://{host}:{port}/api/public/tenants/{tenant_id}/instances",
+            else:
+                instances_listing = self._get_json(session, f"{tenant_url}/instances", stats, "instances")
+            for instance in instances_listing:
+                instances.append(instance)
+                if get_skip_reason(instance) is not None:
+                    continue
+                fingerprint = self._get_instance_fingerprint(instance)
+                previous_status = previous_statuses.get(instance["id"])
+                if (
+                    previous_status is not None
+                    and previous_status.get("fingerprint") == fingerprint
+                    and fetched_at - previous_status.get("fetched_at", 0) <= status_ttl
+                ):
+                    statuses[instance["id"]] = previous_status
+                    stats.statuses_reused += 1
+                else:
+                    pending_statuses.append((instance["id"], fingerprint, executor.submit(
+                        self._get_instance_status, session, f"{tenant_url}/instances/{instance['id']}/status", stats
+                    )))
+            if previous_data:
+                logger.info(
+                    "Incremental refresh of tenant %s of FM %s: %s statuses reused, %s to query",
+                    tenant_id, fleet_manager["id"], len(statuses), len(pending_statuses)
                 )
-                request.raise_for_status()
-                instances = request.json()
-
-                for instance in instances:
-                    logical_instance_id = instance["id"]
-                    node_id = instance["label"]
-                    vnet_id = instance["virtualNetworkId"]
-                    vnet_name = instance["virtualNetworkLabel"]
-                    settings_id = instance["instanceSettingsTemplateId"]
-                    settings_name = instance["instanceSettingsTemplateLabel"]
-                    inventory_hostname = f"fm-{fm_id}-{tenant_id}-{node_id}"
-
-                    # Check tags
-                    if not set(required_fm_tags).issubset(set(instance["fmTags"])):
-                        logger.info("Instance %s skipped, not matching required tags.", inventory_hostname)
-                        continue
 
-                    # Physical instance info
-                    request = session.request(
-                        "GET",
-                        f"{protocol}://{host}:{port}/api/public/tenants/{tenant_id}/instances/{logical_instance_id}/status",
-                    )
-                    request.raise_for_status()
-                    status = request.json()
-
-                    if status.get("hasPhysicalInstance", False) and status.get("cloudMachineIsUp", False):
-                        self.inventory.add_host(inventory_hostname)
-                        inventory_host = self.inventory.hosts[inventory_hostname]
-                        vnets_inventory[vnet_id].add_host(inventory_host)
-                        if network_access == "public_dns":
-                            ansible_host = status["publicDNS"]
-                        elif network_access == "private_dns":
-                            ansible_host = status["privateDNS"]
-                        elif network_access == "private_ip":
-                            ansible_host = status["privateIP"]
-                        else:
-                            ansible_host = status["publicIP"]
-                        inventory_host.set_variable("ansible_host", ansible_host)
-                        inventory_host.set_variable("ansible_user", instance_ssh_user)
-                        dataiku_facts = {
-                            "dss": {
-                                "image_id": instance["imageId"],
-                                "port": "10000",
-                                "datadir": "/data/dataiku/dss_data",
-                                "node_id": node_id,
-                                "node_type": instance["dssNodeType"],
-                                "logical_instance_id": logical_instance_id,
-                            }
+        for instance_id, fingerprint, future in pending_statuses:
+            # Instances whose status could not be fetched are left out, and will be queried again next time
+            status = future.result()
+            if status is not None:
+                statuses[instance_id] = {"fingerprint": fingerprint, "fetched_at": fetched_at, "status": status}
+
+        return {
+            "fetched_at": fetched_at,
+            "vnets": vnets,
+            "templates": templates,
+            "instances": instances,
+            "statuses": statuses,
+        }
+
+    def _populate_tenant(self, fm_id, tenant_id, instances_config, tenant_data):
+        network_access = instances_config.get("access_type", "public_ip")
+        instance_ssh_user = instances_config["ssh"]["user"]
+        # Data cached by older versions of the plugin has no templates
+        templates = tenant_data.get("templates", {})
+        default_port = str(instances_config.get("dss_port", DEFAULT_DSS_PORT))
+        default_datadir = instances_config.get("dss_datadir", DEFAULT_DSS_DATADIR)
+
+        # SSH connection settings are set on the vnet groups, a vnet can override the settings of the FM
+        ssh_tuning = instances_config["ssh"].get("tuning")
+        ssh_vnets_tuning = instances_config["ssh"].get("vnets_tuning", {})
+
+        vnets_inventory = {}
+        self.inventory.add_group(f"fm-{fm_id}-{tenant_id}")
+        tenant_group = self.inventory.groups[f"fm-{fm_id}-{tenant_id}"]
+        for vnet in tenant_data["vnets"]:
+            group_name = f"fm-{fm_id}-{tenant_id}-{vnet['label']}"
+            self.inventory.add_group(group_name)
+            vnet_group = self.inventory.groups[group_name]
+            tenant_group.add_child_group(vnet_group)
+            vnets_inventory[vnet["id"]] = vnet_group
+            if ssh_tuning is not None:
+                self._set_ssh_tuning(vnet_group, dict(ssh_tuning, **ssh_vnets_tuning.get(vnet["label"], {})))
+
+        # In compact mode, the values shared by many hosts are set once on a group, and the tenant group holds
+        # a single templated dataiku dict instead of one dict per host
+        compact_host_vars = self.get_option("compact_host_vars")
+        shared_groups = {}
+        if compact_host_vars:
+            tenant_group.set_variable("ansible_user", instance_ssh_user)
+            tenant_group.set_variable("dataiku", COMPACT_DATAIKU_VARIABLE)
+
+        stats = self._stats[(fm_id, tenant_id)]
+        selected_instances = self._select_instances(tenant_data["instances"], instances_config, fm_id, tenant_id)
+        stats.instances_seen = len(tenant_data["instances"])
+        stats.instances_filtered = stats.instances_seen - len(selected_instances)
+
+        missing_statuses = 0
+        for instance in selected_instances:
+            logical_instance_id = instance["id"]
+            node_id = instance["label"]
+            vnet_id = instance["virtualNetworkId"]
+            inventory_hostname = f"fm-{fm_id}-{tenant_id}-{node_id}"
+            if logical_instance_id not in tenant_data["statuses"]:
+                logger.warning("Instance %s skipped, its status could not be fetched.", inventory_hostname)
+                missing_statuses += 1
+                continue
+            status = tenant_data["statuses"][logical_instance_id]["status"]
+
+            if status.get("hasPhysicalInstance", False) and status.get("cloudMachineIsUp", False):
+                self.inventory.add_host(inventory_hostname)
+                inventory_host = self.inventory.hosts[inventory_hostname]
+                vnets_inventory[vnet_id].add_host(inventory_host)
+                if network_access == "public_dns":
+                    ansible_host = status["publicDNS"]
+                elif network_access == "private_dns":
+                    ansible_host = status["privateDNS"]
+                elif network_access == "private_ip":
+                    ansible_host = status["privateIP"]
+                else:
+                    ansible_host = status["publicIP"]
+                inventory_host.set_variable("ansible_host", ansible_host)
+                template = templates.get(instance["instanceSettingsTemplateId"], {})
+                self._probe_targets.append(
+                    (fm_id, tenant_id, inventory_host, ansible_host, template.get("port") or default_port)
+                )
+                if compact_host_vars:
+                    for group_name, variables in [
+                        (f"fm-{fm_id}-{tenant_id}-template-{instance['instanceSettingsTemplateLabel']}", {
+                            "dataiku_dss_port": template.get("port") or default_port,
+                            "dataiku_dss_datadir": default_datadir,
+                        }),
+                        (f"fm-{fm_id}-{tenant_id}-node-type-{instance['dssNodeType']}", {
+                            "dataiku_dss_node_type": instance["dssNodeType"],
+                        }),
+                        (f"fm-{fm_id}-{tenant_id}-image-{instance['imageId']}", {
+                            "dataiku_dss_image_id": instance["imageId"],
+                        }),
+                    ]:
+                        if group_name not in shared_groups:
+                            self.inventory.add_group(group_name)
+                            shared_groups[group_name] = self.inventory.groups[group_name]
+                            for name, value in variables.items():
+                                shared_groups[group_name].set_variable(name, value)
+                        shared_groups[group_name].add_host(inventory_host)
+                    inventory_host.set_variable("dataiku_dss_node_id", node_id)
+                    inventory_host.set_variable("dataiku_dss_logical_instance_id", logical_instance_id)
+                else:
+                    inventory_host.set_variable("ansible_user", instance_ssh_user)
+                    dataiku_facts = {
+                        "dss": {
+                            "image_id": instance["imageId"],
+                            "port": template.get("port") or default_port,
+                            "datadir": default_datadir,
+                            "node_id": node_id,
+                            "node_type": instance["dssNodeType"],
+                            "logical_instance_id": logical_instance_id,
                         }
-                        inventory_host.set_variable("dataiku", dataiku_facts)
-                        logger.info(
-                            "Generated data for instance %s in group %s", inventory_hostname, vnets_inventory[vnet_id].name
-                        )
-                    else:
-                        logger.info("Instance %s is ignored because physical instance is not found.", inventory_hostname)
+                    }
+                    inventory_host.set_variable("dataiku", dataiku_facts)
+                logger.info(
+                    "Generated data for instance %s in group %s", inventory_hostname, vnets_inventory[vnet_id].name
+                )
+                stats.hosts_added += 1
+            else:
+                logger.info("Instance %s is ignored because physical instance is not found.", inventory_hostname)
+                stats.instances_down += 1
+        stats.instances_skipped = missing_statuses
+        return missing_statuses
+
+    @staticmethod
+    def _set_ssh_tuning(group, ssh_tuning):
+        # The group vars replace the settings of the ssh connection plugin, the tuning is added to them
+        control_persist = ssh_tuning.get("control_persist")
+        if control_persist is not None:
+            configured_args = shlex.split(InventoryModule._get_ssh_connection_option("ssh_args") or "")
+            ssh_args = InventoryModule._remove_ssh_options(configured_args, ["controlmaster", "controlpersist"])
+            if control_persist:
+                ssh_args += ["-o", "ControlMaster=auto", "-o", f"ControlPersist={control_persist}"]
+            if ssh_args != configured_args:
+                group.set_variable("ansible_ssh_args", shlex.join(ssh_args))
+        address_family = ssh_tuning.get("address_family")
+        if address_family:
+            ssh_extra_args = shlex.split(InventoryModule._get_ssh_connection_option("ssh_extra_args") or "")
+            group.set_variable("ansible_ssh_extra_args", shlex.join(ssh_extra_args + ["-o", f"AddressFamily={address_family}"]))
+        group.set_variable("ansible_pipelining", ssh_tuning.get("pipelining", True))
+
+    @staticmethod
+    def _get_ssh_connection_option(name):
+        # Setting of the ssh connection plugin from ansible.cfg or the environment, its definitions are loaded with it
+        connection_loader.get("ssh", class_only=True)
+        return C.config.get_config_value(name, plugin_type="connection", plugin_name="ssh")
+
+    @staticmethod
+    def _remove_ssh_options(args, names):
+        """Returns the ssh args without their -o options (-o Name=value or -oName=value) of the given lowercase names"""
+        result = []
+        index = 0
+        while index < len(args):
+            arg = args[index]
+            if arg == "-o" and index + 1 < len(args):
+                option, length = args[index + 1], 2
+            elif arg.startswith("-o"):
+                option, length = arg[2:], 1
+            else:
+                option, length = None, 1
+            if option is None or re.split(r"[\s=]", option.strip(), maxsplit=1)[0].lower() not in names:
+                result += args[index:index + length]
+            index += length
+        return result
+
+    @staticmethod
+    def _select_instances(instances, instances_config, fm_id=None, tenant_id=None):
+        get_skip_reason = InventoryModule._build_instance_filter(instances_config)
+        selected_instances = []
+        for instance in instances:
+            reason = get_skip_reason(instance)
+            if reason is None:
+                selected_instances.append(instance)
+            elif fm_id is not None:
+                logger.info("Instance %s skipped, %s.", f"fm-{fm_id}-{tenant_id}-{instance['label']}", reason)
+        return selected_instances
+
+    @staticmethod
+    def _build_instance_filter(instances_config):
+        # Filters only rely on the instances listing, so excluded instances never cost a status request
+        required_fm_tags = set(instances_config.get("required_fm_tags", []))
+        filters = instances_config.get("filters", {})
+        node_types = filters.get("node_types")
+        excluded_node_types = filters.get("excluded_node_types", [])
+        vnets = filters.get("vnets")
+        label_regex = re.compile(filters["label_regex"]) if filters.get("label_regex") else None
+        image_ids = filters.get("image_ids")
+        templates = filters.get("templates")
+
+        def get_skip_reason(instance):
+            if not required_fm_tags.issubset(set(instance["fmTags"])):
+                return "not matching required tags"
+            if node_types is not None and instance["dssNodeType"] not in node_types:
+                return "node type not included"
+            if instance["dssNodeType"] in excluded_node_types:
+                return "node type excluded"
+            if vnets is not None and instance["virtualNetworkLabel"] not in vnets:
+                return "vnet not included"
+            if label_regex is not None and not label_regex.search(instance["label"]):
+                return "label not matching regex"
+            if image_ids is not None and instance["imageId"] not in image_ids:
+                return "image not included"
+            if templates is not None and instance["instanceSettingsTemplateLabel"] not in templates:
+                return "instance settings template not included"
+            return None
+
+        return get_skip_reason
+
+    @staticmethod
+    def _get_template_settings(template):
+        # Only the DSS settings used by the host vars are kept from the template
+        port = None
+        for setup_action in template.get("setupActions") or []:
+            if setup_action.get("type") == "UPDATE_DSS_PORT" and setup_action.get("enabled", True):
+                params = setup_action.get("params") or {}
+                port = params.get("dssPort", params.get("port"))
+        return {
+            "label": template.get("label"),
+            "port": str(port) if port is not None else None,
+        }
+
+    @staticmethod
+    def _get_compact_instance(instance):
+        return {field: instance.get(field) for field in INSTANCE_FIELDS}
+
+    @staticmethod
+    def _get_instance_fingerprint(instance):
+        fingerprinted_fields = {
+            "label": instance.get("label"),
+            "imageId": instance.get("imageId"),
+            "instanceSettingsTemplateId": instance.get("instanceSettingsTemplateId"),
+            "fmTags": sorted(instance.get("fmTags", [])),
+            "virtualNetworkId": instance.get("virtualNetworkId"),
+        }
+        return hashlib.sha1(json.dumps(fingerprinted_fields, sort_keys=True).encode("UTF-8")).hexdigest()
+
+    def _get_instance_status(self, session, url, stats=None):
+        try:
+            return self._get_json(session, url, stats, "instances/{id}/status")
         except Exception as e:
-            logger.error(e, exc_info=True)
+            logger.warning("Failed to fetch instance status from %s: %s", url, e)
+            return None
+
+    @staticmethod
+    def _get_api_key(fleet_manager):
+        api_key_config = fleet_manager["api_key"]
+        api_key_id = None
+        api_key_secret = None
+        created = False
+        if "file" in api_key_config:
+            file_path = os.path.expanduser(api_key_config["file"])
+            if not os.path.exists(file_path) and api_key_config.get(
+                "ssh_auto_create", False
+            ):
+                api_key_id, api_key_secret = InventoryModule._create_api_key_with_ssh(fleet_manager, file_path)
+                created = True
+            else:
+                with open(file_path, "r") as file:
+                    api_key_data = json.load(file)
+                    api_key_id = api_key_data["id"]
+                    api_key_secret = api_key_data["secret"]
+        elif "aws_secret_manager" in api_key_config:
+            logger.fatal("aws_secret_manager fetch method not implemented.")
+        elif "azure_vault" in api_key_config:
+            logger.fatal("azure_vault fetch method not implemented.")
+        elif "gcp_secret_manager" in api_key_config:
+            logger.fatal("gcp_secret_manager fetch method not implemented.")
+        return api_key_id, api_key_secret, created
+
+    @staticmethod
+    def _create_api_key_with_ssh(fleet_manager, file_path):
+        ssh_user = fleet_manager["ssh"]["user"]
+        ssh_host = fleet_manager["ssh"].get("host", fleet_manager["host"])
+        ssh_fm_unix_user = fleet_manager["ssh"].get(
+            "fm_unix_user", "dataiku"
+        )
+        ssh_fm_user = fleet_manager["ssh"].get("fm_user", "admin")
+        ssh_fm_datadir = fleet_manager["ssh"].get(
+            "datadir", "/data/dataiku/fmhome"
+        )
+        # Share the ssh connection between the calls made to the same FM host
+        control_path_dir = os.path.expanduser(fleet_manager["ssh"].get("control_path_dir", "~/.ansible/cp"))
+        os.makedirs(control_path_dir, mode=0o700, exist_ok=True)
+        ssh_command = [
+            "ssh",
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            f"User={ssh_user}",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={control_path_dir}/fm-%C",
+            "-o",
+            f"ControlPersist={fleet_manager['ssh'].get('control_persist', '60s')}",
+            ssh_host,
+        ]
+        command = [
+            f"{ssh_fm_datadir}/bin/fmadmin",
+            "create-personal-api-key",
+            ssh_fm_user,
+        ]
+        if ssh_fm_unix_user != ssh_user:
+            command = ["sudo", "-u", ssh_fm_unix_user] + command
+        ssh_process = subprocess.Popen(
+            ssh_command + command,
+            shell=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            close_fds=True,
+        )
+        stdout, stderr = ssh_process.communicate()
+        if ssh_process.returncode != 0:
+            raise Exception(
+                f"Failed to execute ssh command. stdout={stdout} stderr={stderr}"
+            )
+        id = None
+        secret = None
+        for line in reversed(stdout.decode().splitlines()):
+            if line.startswith("Key id: "):
+                id = line[8:]
+            if line.startswith("Key secret: "):
+                secret = line[12:]
+            if id is not None and secret is not None:
+                break
+        with open(file_path, "w") as file:
+            json.dump({"id": id, "secret": secret}, file, indent=2)
+        os.chmod(file_path, stat.S_IRUSR | stat.S_IWUSR)
+        return id, secret
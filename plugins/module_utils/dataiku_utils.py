@@ -1,12 +1,24 @@
 import copy
+import hashlib
+import importlib
+import importlib.util
+import json
 import os
 import re
+import shutil
 import sys
+import tempfile
+import time
 import traceback
+import types
 
 from ansible.module_utils import six
 from ansible.module_utils.basic import missing_required_lib
-from ansible.module_utils.common.collections import Mapping
+from ansible.module_utils.common.collections import Mapping, MutableMapping
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible_collections.dataiku.dss.plugins.module_utils.dss_httpapi import PersistentConnectionSession
+from ansible_collections.dataiku.dss.plugins.module_utils import dss_perf
+from ansible_collections.dataiku.dss.plugins.module_utils import dss_rest_client
 
 # Import Error handling required du to ansible sanity checks handling of non-default python libraries
 # https://docs.ansible.com/ansible/latest/dev_guide/testing/sanity/import.html
@@ -21,6 +33,23 @@ else:
     PACKAGING_IMPORT_ERROR = None
 
 
+# Clients by (node type, URL, API key, persistent connection, transport options). A module run in the controller process by its action
+# plugin keeps its clients, and so their HTTP connections, for all the items of a task loop
+_clients = {}
+
+# API key given to the DSS API clients of a persistent connection without one: the clients require a key, but the
+# dataiku.dss.dss httpapi plugin sends the credentials of the connection with every request
+PERSISTENT_CONNECTION_API_KEY = "httpapi-connection"
+
+# Seconds during which a cached DSS API response is used, see cached_api_read
+DEFAULT_API_CACHE_TTL = 300
+# Prefix of the API cache directories of the plays, created by the action plugins
+API_CACHE_DIR_PREFIX = "dataiku-dss-api-cache-"
+
+# Python install dirs by data dir, with the modification time of the env-default.sh file they were read from
+_install_dirs = {}
+
+
 class MakeNamespace(object):
     def __init__(self, values):
         self.__dict__.update(values)
@@ -39,19 +68,35 @@ def is_version_more_recent(module, input_version, baseline):
 
 
 def discover_install_dir_python(data_dir):
-    pattern = re.compile(r'^export\sDKUINSTALLDIR=\"(.*)\"$')
+    env_file = f"{data_dir}/bin/env-default.sh"
     try:
-        for line in open(f"{data_dir}/bin/env-default.sh", encoding="UTF-8"):
-            match = re.match(pattern, line)
-            if match:
-                install_dir = match.group(1)
-                return f"{install_dir}/python"
+        mtime = os.stat(env_file).st_mtime_ns
+    except FileNotFoundError:
         return
+    cached = _install_dirs.get(data_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    pattern = re.compile(r'^export\sDKUINSTALLDIR=\"(.*)\"$')
+    install_dir = None
+    try:
+        with open(env_file, encoding="UTF-8") as env_content:
+            for line in env_content:
+                if not line.startswith("export DKUINSTALLDIR="):
+                    continue
+                match = re.match(pattern, line)
+                if match:
+                    install_dir = f"{match.group(1)}/python"
+                    break
     except FileNotFoundError:
         return
+    _install_dirs[data_dir] = (mtime, install_dir)
+    return install_dir
 
 
 def bootstrap_dataiku_module(module):
+    if boolean(os.environ.get("DATAIKU_ANSIBLE_DSS_PERF", False), strict=False):
+        start_api_call_recording(module)
     if module.params.get("connect_to"):
         if module.params["connect_to"].get("node_type"):
             module.no_log_values.remove(module.params['connect_to']['node_type'])
@@ -62,6 +107,27 @@ def bootstrap_dataiku_module(module):
     add_dataikuapi_to_path(module)
 
 
+def start_api_call_recording(module):
+    """Records the DSS API calls of the module run and returns their totals by phase as perf in its result
+
+    The run starts in the bootstrap phase, the module moves to the next ones with set_perf_phase. Enabled by the
+    DATAIKU_ANSIBLE_DSS_PERF env var, which the action plugins set from the dataiku_dss_perf variable.
+    """
+    recorder = dss_perf.ApiCallRecorder()
+    module._dss_perf = recorder
+    exit_json = module.exit_json
+    fail_json = module.fail_json
+    module.exit_json = lambda **kwargs: exit_json(perf=recorder.summary(), **kwargs)
+    module.fail_json = lambda msg, **kwargs: fail_json(msg, perf=recorder.summary(), **kwargs)
+
+
+def set_perf_phase(module, phase):
+    """Starts a phase of the module run (read, diff or write) when its API calls are recorded"""
+    recorder = getattr(module, "_dss_perf", None)
+    if recorder is not None:
+        recorder.set_phase(phase)
+
+
 def add_dataikuapi_to_path(module):
     args = MakeNamespace(module.params)
 
@@ -73,15 +139,67 @@ def add_dataikuapi_to_path(module):
 
     install_dir = discover_install_dir_python(data_dir)
 
+    # Without a DSS install, ex: on the controller, dataikuapi is used if it is installed, or the built-in client
     if install_dir is None:
-        module.fail_json(
-            msg=f"Failed to discover install_dir with the provided data_dir \'{install_dir}\' information."
-        )
+        if importlib.util.find_spec("dataikuapi"):
+            import_dataikuapi_lazily()
+        elif not dss_rest_client.HAS_REQUESTS_LIBRARY:
+            module.fail_json(
+                msg=f"Failed to discover install_dir with the provided data_dir \'{data_dir}\' information, "
+                    f"and the built-in DSS client requires {missing_required_lib('requests')}",
+                exception=dss_rest_client.REQUESTS_IMPORT_ERROR
+            )
+        return
 
-    sys.path.append(install_dir)
+    if install_dir not in sys.path:
+        sys.path.append(install_dir)
+    import_dataikuapi_lazily()
     return
 
 
+def import_dataikuapi_lazily():
+    """Makes the dataikuapi package importable without running its __init__.py
+
+    The package __init__.py imports all the clients and their dependencies. With this, importing a submodule
+    (ex: dataikuapi.utils) only imports what it needs. The content of the package itself is still loaded on
+    first use (ex: dataikuapi.DSSClient).
+    """
+    if "dataikuapi" in sys.modules:
+        return
+    spec = importlib.util.find_spec("dataikuapi")
+    if spec is None or spec.submodule_search_locations is None:
+        return
+
+    package = types.ModuleType("dataikuapi")
+    package.__spec__ = spec
+    package.__path__ = list(spec.submodule_search_locations)
+    package.__file__ = spec.origin
+    package.__package__ = "dataikuapi"
+
+    def load_package_attribute(name):
+        if importlib.util.find_spec(f"dataikuapi.{name}") is not None:
+            return importlib.import_module(f"dataikuapi.{name}")
+        del package.__getattr__
+        spec.loader.exec_module(package)
+        return getattr(package, name)
+
+    package.__getattr__ = load_package_attribute
+    sys.modules["dataikuapi"] = package
+
+
+def uses_builtin_client():
+    """Whether the modules use the built-in DSS client of dss_rest_client, when dataikuapi is not available"""
+    return importlib.util.find_spec("dataikuapi") is None
+
+
+def get_dataiku_exception_class():
+    """The exception raised on DSS API errors by the client returned by get_client_from_parsed_args"""
+    if uses_builtin_client():
+        return dss_rest_client.DataikuException
+    from dataikuapi.utils import DataikuException
+    return DataikuException
+
+
 def add_dss_connection_args(module_args):
     module_args.update(
         {
@@ -91,19 +209,55 @@ def add_dss_connection_args(module_args):
             "api_key": dict(type="str", required=False, default=None, no_log=True),
             "node_type": dict(type="str", required=False, default=None),
             "data_dir": dict(type="str", required=False, default=None),
+            "transport": dict(type="dict", required=False, default=None, options=dict(
+                scheme=dict(type="str", required=False, default=None, choices=["http", "https"]),
+                ca_bundle=dict(type="path", required=False, default=None),
+                connect_timeout=dict(type="float", required=False, default=None),
+                read_timeout=dict(type="float", required=False, default=None),
+                retries=dict(type="int", required=False, default=None),
+                retry_backoff=dict(type="float", required=False, default=None),
+                pool_maxsize=dict(type="int", required=False, default=None),
+            )),
         }
     )
 
 
+def _get_transport_options(args):
+    """Returns the transport options from the transport parameter, the transport of connect_to or the
+    DATAIKU_ANSIBLE_DSS_<OPTION> env vars, see configure_session in dss_rest_client"""
+    options = dict(
+        scheme="http",
+        ca_bundle=None,
+        connect_timeout=dss_rest_client.DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=None,
+        retries=dss_rest_client.DEFAULT_RETRIES,
+        retry_backoff=dss_rest_client.DEFAULT_RETRY_BACKOFF,
+        pool_maxsize=dss_rest_client.POOL_MAXSIZE,
+    )
+    connect_to_transport = (args.connect_to or {}).get("transport") or {}
+    for name, convert in (("scheme", str), ("ca_bundle", str), ("connect_timeout", float), ("read_timeout", float),
+                          ("retries", int), ("retry_backoff", float), ("pool_maxsize", int)):
+        value = os.environ.get(f"DATAIKU_ANSIBLE_DSS_{name.upper()}", None)
+        if args.transport and args.transport.get(name) is not None:
+            value = args.transport[name]
+        elif connect_to_transport.get(name) is not None:
+            value = connect_to_transport[name]
+        if value is not None:
+            options[name] = convert(value)
+    return options
+
+
 def get_client_from_parsed_args(module, supported_node_types):
     args = MakeNamespace(module.params)
+    # When the task runs with the dataiku.dss.dss httpapi plugin, the connection holds the DSS URL and API key
+    socket_path = getattr(module, "_socket_path", None)
     api_key = os.environ.get("DATAIKU_ANSIBLE_DSS_API_KEY", None)
     if args.api_key:
         api_key = args.api_key
     elif args.connect_to and "api_key" in args.connect_to:
         api_key = args.connect_to["api_key"]
 
-    if api_key is None:
+    if api_key is None and socket_path is None:
         module.fail_json(
             msg="Missing an API Key, either from 'api_key' parameter, 'connect_to' parameter or DATAIKU_ANSIBLE_DSS_API_KEY env var"
         )
@@ -131,16 +285,115 @@ def get_client_from_parsed_args(module, supported_node_types):
             msg="Node type {} is not supported. Supported node types are {}".format(node_type, supported_node_types)
         )
 
-    if node_type == "govern":
-        from dataikuapi.govern_client import GovernClient
-        client = GovernClient(f"http://{host}:{port}", api_key=api_key)
-    else:
-        from dataikuapi.dssclient import DSSClient
-        client = DSSClient(f"http://{host}:{port}", api_key=api_key)
+    if api_key is None:
+        api_key = PERSISTENT_CONNECTION_API_KEY
+
+    transport = _get_transport_options(args)
+    url = "{}://{}:{}".format(transport.pop("scheme"), host, port)
+    client_key = (node_type == "govern", url, api_key, socket_path, tuple(sorted(transport.items())))
+    client = _clients.get(client_key)
+    if client is None:
+        if uses_builtin_client():
+            client = dss_rest_client.DSSRestClient(url, api_key=api_key)
+        elif node_type == "govern":
+            from dataikuapi.govern_client import GovernClient
+            client = GovernClient(url, api_key=api_key)
+        else:
+            from dataikuapi.dssclient import DSSClient
+            client = DSSClient(url, api_key=api_key)
 
+        if socket_path is not None:
+            # The transport of the persistent connection is set on the connection, see the httpapi plugin options
+            client._session = PersistentConnectionSession(socket_path)
+        else:
+            dss_rest_client.configure_session(client._session, **transport)
+        client._session = dss_perf.RecordingSession(client._session)
+        _clients[client_key] = client
+
+    # The client may have been created by a previous module run of the controller process
+    client._session.recorder = getattr(module, "_dss_perf", None)
     return client
 
 
+def _get_api_cache_dir(module, client, object_class):
+    cache_dir = os.environ.get("DATAIKU_ANSIBLE_DSS_CACHE_DIR")
+    if not cache_dir:
+        return None
+    # Through a persistent connection, the client URL is the default one and the socket identifies the DSS
+    dss_id = f"{client.host} {getattr(module, '_socket_path', None) or ''}"
+    return os.path.join(cache_dir, hashlib.sha256(dss_id.encode("UTF-8")).hexdigest()[:16], object_class)
+
+
+def cached_api_read(module, client, object_class, endpoint, read):
+    """Returns the result of read(), a DSS API read call, from the API cache when it is enabled
+
+    The cache is enabled by the DATAIKU_ANSIBLE_DSS_CACHE_DIR env var, which the action plugins set to a directory per
+    play. The JSON results are kept by DSS, object class and endpoint for DATAIKU_ANSIBLE_DSS_CACHE_TTL seconds, or until
+    a module writes an object of the same class and calls invalidate_api_cache.
+    """
+    class_dir = _get_api_cache_dir(module, client, object_class)
+    if class_dir is None:
+        return read()
+
+    ttl = float(os.environ.get("DATAIKU_ANSIBLE_DSS_CACHE_TTL", DEFAULT_API_CACHE_TTL))
+    cache_file = os.path.join(class_dir, f"{hashlib.sha256(endpoint.encode('UTF-8')).hexdigest()}.json")
+    try:
+        if time.time() - os.stat(cache_file).st_mtime < ttl:
+            with open(cache_file, encoding="UTF-8") as cached:
+                return json.load(cached)
+    except (OSError, ValueError):
+        pass
+
+    value = read()
+    try:
+        cache_dir = os.environ["DATAIKU_ANSIBLE_DSS_CACHE_DIR"]
+        if not os.path.isdir(cache_dir):
+            _purge_stale_api_caches(cache_dir, ttl)
+        os.makedirs(class_dir, mode=0o700, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=class_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="UTF-8") as cached:
+            json.dump(value, cached)
+        # Replaced at once so that concurrent tasks never read a partial file
+        os.replace(temp_file, cache_file)
+    except OSError:
+        # The cache is only an optimization, the module goes on without it
+        pass
+    return value
+
+
+def _purge_stale_api_caches(cache_dir, ttl):
+    """Removes the API cache directories of the other plays whose responses have all expired
+
+    Nothing tells when a play ends, so the directory of a play is left behind and removed by the first play that
+    caches a response next to it once it is stale.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(cache_dir))
+    try:
+        names = os.listdir(parent_dir)
+    except OSError:
+        return
+    for name in names:
+        play_dir = os.path.join(parent_dir, name)
+        if not name.startswith(API_CACHE_DIR_PREFIX) or not os.path.isdir(play_dir):
+            continue
+        try:
+            last_write = max(
+                os.stat(os.path.join(root, file_name)).st_mtime
+                for root, dirs, files in os.walk(play_dir) for file_name in files + ["."]
+            )
+        except (OSError, ValueError):
+            continue
+        if time.time() - last_write > ttl:
+            shutil.rmtree(play_dir, ignore_errors=True)
+
+
+def invalidate_api_cache(module, client, object_class):
+    """Drops the cached DSS API responses of an object class, to be called after writing an object of this class"""
+    class_dir = _get_api_cache_dir(module, client, object_class)
+    if class_dir is not None:
+        shutil.rmtree(class_dir, ignore_errors=True)
+
+
 # Similar to dict.update but deep
 def update(d, u):
     if isinstance(d, Mapping):
@@ -154,16 +407,200 @@ def update(d, u):
     return d
 
 
-def smart_update_named_lists(l1, l2):
-    result = copy.deepcopy(l1)
-    for el2 in l2:
-        name2 = el2["name"]
-        for idx1, el1 in enumerate(l1):
-            if el1["name"] == name2:
-                result[idx1].update(el2)
-                break
-        else:
-            result.append(el2)
+class SettingsOverlay(MutableMapping):
+    """A dict recording the changes made on top of a settings document, its base, instead of a deep copy of it
+
+    The base is never modified: reading a nested mapping returns an overlay of it and reading a list returns a deep copy
+    of it, as its elements may be changed in place. materialize() returns the merged document, where the unchanged
+    values are the ones of the base. diff_structures only walks the values read or changed when it compares an overlay
+    with its base.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self._values = {}
+        self._removed = set()
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key in self._removed:
+            raise KeyError(key)
+        value = self.base[key]
+        if isinstance(value, Mapping):
+            value = self._values[key] = SettingsOverlay(value)
+        elif isinstance(value, list):
+            value = self._values[key] = copy.deepcopy(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._removed.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        if key in self.base:
+            self._removed.add(key)
+
+    def __contains__(self, key):
+        return key in self._values or (key in self.base and key not in self._removed)
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self._removed:
+                yield key
+        for key in self._values:
+            if key not in self.base:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return f"SettingsOverlay({self.materialize()!r})"
+
+    def materialize(self):
+        result = {key: value for key, value in self.base.items() if key not in self._removed}
+        for key, value in self._values.items():
+            result[key] = _materialize(value)
+        return result
+
+
+def _materialize(value):
+    return value.materialize() if isinstance(value, SettingsOverlay) else value
+
+
+def diff_structures(before, after):
+    """Returns the JSON Patch (RFC 6902) operations turning before into after, found in one walk of both structures
+
+    Mappings are compared key by key and lists index by index. There are no operations if and only if before == after.
+    """
+    changes = []
+    _diff_structures(changes, "", before, after)
+    return changes
+
+
+def _diff_structures(changes, path, before, after):
+    if before is after:
+        return
+    if isinstance(after, SettingsOverlay) and after.base is before:
+        # Only the values read or changed through the overlay can differ from its base
+        for key in after._removed:
+            changes.append({"op": "remove", "path": f"{path}/{_escape_json_pointer(key)}"})
+        for key, value in after._values.items():
+            key_path = f"{path}/{_escape_json_pointer(key)}"
+            if key in before:
+                _diff_structures(changes, key_path, before[key], value)
+            else:
+                changes.append({"op": "add", "path": key_path, "value": _materialize(value)})
+    elif isinstance(before, Mapping) and isinstance(after, Mapping):
+        for key, value in before.items():
+            key_path = f"{path}/{_escape_json_pointer(key)}"
+            if key in after:
+                _diff_structures(changes, key_path, value, after[key])
+            else:
+                changes.append({"op": "remove", "path": key_path})
+        for key, value in after.items():
+            if key not in before:
+                changes.append({"op": "add", "path": f"{path}/{_escape_json_pointer(key)}", "value": _materialize(value)})
+    elif isinstance(before, list) and isinstance(after, list):
+        common_length = min(len(before), len(after))
+        for index in range(common_length):
+            _diff_structures(changes, f"{path}/{index}", before[index], after[index])
+        for index in range(common_length, len(after)):
+            changes.append({"op": "add", "path": f"{path}/{index}", "value": _materialize(after[index])})
+        # From the end, so that the indexes stay valid when the operations are applied in order
+        for index in range(len(before) - 1, common_length - 1, -1):
+            changes.append({"op": "remove", "path": f"{path}/{index}"})
+    elif before != after:
+        changes.append({"op": "replace", "path": path, "value": _materialize(after)})
+
+
+def _escape_json_pointer(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _get_json_pointer_value(document, pointer):
+    for part in pointer.split("/")[1:]:
+        part = part.replace("~1", "/").replace("~0", "~")
+        document = document[int(part)] if isinstance(document, list) else document[part]
+    return document
+
+
+def build_diff_output(before, changes):
+    """Returns the --diff output of the changes found by diff_structures: the previous and new values of the changed
+    paths only"""
+    diff = {"before": {}, "after": {}}
+    for change in changes:
+        if change["op"] != "add":
+            diff["before"][change["path"]] = _get_json_pointer_value(before, change["path"])
+        if change["op"] != "remove":
+            diff["after"][change["path"]] = change["value"]
+    return diff
+
+
+def set_result_changes(module, result, before, after):
+    """Sets the changes from before to after, None for a missing object, in the result of a module and its --diff
+    output when it is requested. Returns the changes."""
+    before = before if before is not None else {}
+    changes = diff_structures(before, after if after is not None else {})
+    result["changes"] = changes
+    if module._diff:
+        result["diff"] = build_diff_output(before, changes)
+    return changes
+
+
+def smart_update_named_lists(l1, l2, key="name"):
+    """Returns l1 where the elements with the key of an element of l2 are updated with it, and the others of l2 appended
+
+    The elements of l1 are indexed by key, so the merge is linear. l1 is left unchanged: the updated elements are
+    copies, the other ones are shared with l1. The elements without key are never merged, the ones of l2 are appended.
+    """
+    result = list(l1)
+    indexes = {}
+    for index, element in enumerate(l1):
+        if element.get(key) is not None:
+            indexes.setdefault(element[key], index)
+    for element in l2:
+        index = indexes.get(element.get(key)) if element.get(key) is not None else None
+        if index is None:
+            result.append(element)
+            continue
+        if result[index] is l1[index]:
+            result[index] = dict(l1[index])
+        result[index].update(element)
+    return result
+
+
+def smart_update_named_lists_at_paths(current, updates, keys_by_path):
+    """Returns the named lists of current at the dotted paths of keys_by_path, merged with the ones of updates
+
+    The lists are merged with smart_update_named_lists on the key of their path, and returned in a document with these
+    paths only. The lists missing or empty in updates are returned unchanged, the ones missing in both are left out. The
+    missing or None sections of current have nothing to merge, the lists of updates under them are returned as is.
+    """
+    selector = KeySelector(keys_by_path.keys())
+    result = selector.extract(current)
+    for parts, key in zip(selector.paths, keys_by_path.values()):
+        parents = [result]
+        new_list = updates
+        for part in parts[:-1]:
+            if not isinstance(parents[-1].get(part), Mapping):
+                parents[-1][part] = {}
+            parents.append(parents[-1][part])
+            new_list = new_list.get(part) if isinstance(new_list, Mapping) else None
+        new_list = new_list.get(parts[-1]) if isinstance(new_list, Mapping) else None
+        if new_list:
+            parents[-1][parts[-1]] = smart_update_named_lists(parents[-1].get(parts[-1]) or [], new_list, key)
+        elif parents[-1].get(parts[-1]) is None:
+            # Not to create the list, nor its parents, when the settings are saved
+            parents[-1].pop(parts[-1], None)
+            for parent, part in reversed(list(zip(parents[:-1], parts[:-1]))):
+                if parent[part]:
+                    break
+                del parent[part]
     return result
 
 
@@ -181,21 +618,79 @@ def extract_keys(input_data, keys_reference):
 
 
 def exclude_keys(dictionary, excluded_keys):
+    return KeySelector(excluded_keys).exclude(dictionary)
+
+
+class KeySelector(object):
+    """Dotted key paths (ex: ldapSettings.bindPassword) compiled once into a tree, to select them in settings documents
+
+    extract() is extract_keys with the template of the paths, exclude() is exclude_keys, and project() returns both
+    from a single traversal. A selector can be built once as a module constant.
+    """
+
+    def __init__(self, paths, delimiter="."):
+        self.paths = [tuple(path.split(delimiter)) for path in paths]
+        # Nested dicts of the path parts, a leaf being an empty dict
+        self._tree = {}
+        for parts in self.paths:
+            node = self._tree
+            for part in parts:
+                node = node.setdefault(part, {})
+
+    def extract(self, data):
+        return _extract_tree(data, self._tree)
+
+    def exclude(self, data):
+        return _exclude_tree(data, self._tree)
+
+    def project(self, data):
+        """Returns (self.extract(data), self.exclude(data))"""
+        return _project_tree(data, self._tree)
+
+
+def _extract_tree(data, tree):
+    if not isinstance(data, Mapping):
+        return data
+    return {key: _extract_tree(data.get(key, {}), children) if children else data.get(key)
+            for key, children in tree.items()}
+
+
+def _exclude_tree(data, tree):
     result = {}
-    excluded_parts = [key.split(".") for key in excluded_keys]
-    first_level_keys = [part[0] for part in excluded_parts]
-    for key, value in dictionary.items():
-        if key not in first_level_keys:
+    for key, value in data.items():
+        children = tree.get(key)
+        if children is None:
             result[key] = value
+        elif isinstance(value, dict):
+            result[key] = _exclude_tree(value, children)
         else:
-            if isinstance(value, dict):
-                nested_excluded_keys = [".".join(part[1:]) for part in excluded_parts if len(part) > 1]
-                result[key] = exclude_keys(value, nested_excluded_keys)
-            else:
-                result[key] = None
+            result[key] = None
     return result
 
 
+def _project_tree(data, tree):
+    if not isinstance(data, Mapping):
+        return data, data
+    extracted = {}
+    excluded = {}
+    for key, value in data.items():
+        children = tree.get(key)
+        if children is None:
+            excluded[key] = value
+        elif not children:
+            extracted[key] = value
+            excluded[key] = _exclude_tree(value, children) if isinstance(value, dict) else None
+        elif isinstance(value, dict):
+            extracted[key], excluded[key] = _project_tree(value, children)
+        else:
+            extracted[key] = value
+            excluded[key] = None
+    for key, children in tree.items():
+        if key not in extracted:
+            extracted[key] = _extract_tree({}, children) if children else None
+    return extracted, excluded
+
+
 def _build_template_from_field(base_template, values, default_value):
     current_key = values.pop(0)
     if len(values) == 0:
@@ -209,5 +704,6 @@ def build_template_from_fields(fields, default_value, delimiter="."):
     result = dict()
     for field in fields:
         all_keys = field.split(delimiter)
-        result.update(_build_template_from_field(dict(), all_keys, default_value))
+        # Deep, for the fields sharing a parent
+        update(result, _build_template_from_field(dict(), all_keys, default_value))
     return result
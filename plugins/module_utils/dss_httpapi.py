@@ -0,0 +1,70 @@
+import json
+
+from ansible.module_utils.connection import Connection
+from ansible.module_utils.six.moves.urllib.parse import urlsplit
+
+
+class PersistentConnectionResponse(object):
+    """The parts of a requests.Response used by the DSS API clients"""
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def content(self):
+        return self.text.encode("UTF-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise PersistentConnectionHTTPError(f"{self.status_code} Error: {self.text}", response=self)
+
+    def close(self):
+        pass
+
+
+class PersistentConnectionHTTPError(Exception):
+    def __init__(self, message, response=None):
+        super(PersistentConnectionHTTPError, self).__init__(message)
+        self.response = response
+
+
+class PersistentConnectionSession(object):
+    """Replaces the requests.Session of a DSS API client to send its requests through the persistent
+    connection of the task, see the dataiku.dss.dss httpapi plugin"""
+
+    def __init__(self, socket_path):
+        self._connection = Connection(socket_path)
+        self.headers = {}
+        self.auth = None
+        self.verify = True
+        self.cert = None
+
+    def request(self, method, url, params=None, data=None, files=None, stream=False, headers=None, **kwargs):
+        if files:
+            raise ValueError("File uploads are not supported through the persistent DSS connection")
+        # The connection knows the DSS URL, only the path is sent
+        split_url = urlsplit(url)
+        path = f"{split_url.path}?{split_url.query}" if split_url.query else split_url.path
+        request_headers = dict(self.headers)
+        if data is not None:
+            request_headers.setdefault("Content-Type", "application/json")
+        request_headers.update(headers or {})
+        if isinstance(data, bytes):
+            data = data.decode("UTF-8")
+
+        response = self._connection.send_request(
+            data, method=method, path=path, params=params, headers=request_headers
+        )
+        return PersistentConnectionResponse(response["status_code"], response["text"], response["headers"])
+
+    def close(self):
+        pass
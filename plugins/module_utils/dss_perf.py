@@ -0,0 +1,134 @@
+import re
+import time
+
+from ansible.module_utils.six.moves.urllib.parse import urlsplit
+
+# Phases of a module run, in their order. The bootstrap goes until the DSS client is ready, the module then reads the
+# current objects, computes the changes and writes them
+PHASES = ["bootstrap", "read", "diff", "write"]
+
+# Prefixes of the public APIs of DSS and Govern, removed from the recorded paths
+API_PATH_PREFIXES = ["/dip/publicapi", "/public/api"]
+
+# Templates of the paths called by the modules, so that the calls on different objects are grouped together
+PATH_TEMPLATES = [
+    (re.compile(r"^/admin/users/[^/]+"), "/admin/users/{login}"),
+    (re.compile(r"^/admin/groups/[^/]+"), "/admin/groups/{name}"),
+    (re.compile(r"^/admin/connections/[^/]+"), "/admin/connections/{name}"),
+    (re.compile(r"^/admin/code-envs/[^/]+/[^/]+"), "/admin/code-envs/{lang}/{name}"),
+    (re.compile(r"^/plugins/(?!actions/)[^/]+"), "/plugins/{pluginId}"),
+    (re.compile(r"^/futures/[^/]+"), "/futures/{jobId}"),
+    (re.compile(r"^/api-deployer/infras/[^/]+"), "/api-deployer/infras/{infraId}"),
+]
+
+
+def get_path_template(url):
+    path = urlsplit(url).path
+    for prefix in API_PATH_PREFIXES:
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+            break
+    for pattern, template in PATH_TEMPLATES:
+        path, count = pattern.subn(template, path, count=1)
+        if count:
+            break
+    return path
+
+
+class ApiCallRecorder(object):
+    """Records the HTTP calls made by the DSS API clients of a module run, and the time spent in each phase of the run"""
+
+    def __init__(self):
+        self.calls = []
+        self.phase = PHASES[0]
+        self._phase_start = time.perf_counter()
+        self._phase_durations = {}
+
+    def set_phase(self, phase):
+        now = time.perf_counter()
+        self._phase_durations[self.phase] = self._phase_durations.get(self.phase, 0) + now - self._phase_start
+        self.phase = phase
+        self._phase_start = now
+
+    def record(self, method, url, status, bytes_sent, bytes_received, duration):
+        self.calls.append(dict(
+            phase=self.phase,
+            method=method.upper(),
+            path=get_path_template(url),
+            status=status,
+            bytes_sent=bytes_sent,
+            bytes_received=bytes_received,
+            duration_ms=round(duration * 1000, 3),
+        ))
+
+    def summary(self):
+        """Returns the totals of the calls and durations, by phase and for the whole run, and the calls"""
+        self.set_phase(self.phase)
+        phases = [phase for phase in PHASES if phase in self._phase_durations]
+        phases += [phase for phase in self._phase_durations if phase not in PHASES]
+        return dict(
+            totals=_get_totals(self.calls, sum(self._phase_durations.values())),
+            phases={
+                phase: _get_totals([call for call in self.calls if call["phase"] == phase], self._phase_durations[phase])
+                for phase in phases
+            },
+            calls=self.calls,
+        )
+
+
+def _get_totals(calls, duration):
+    return dict(
+        calls=len(calls),
+        errors=len([call for call in calls if call["status"] is None or call["status"] >= 400]),
+        bytes_sent=sum(call["bytes_sent"] for call in calls),
+        bytes_received=sum(call["bytes_received"] for call in calls),
+        api_duration_ms=round(sum(call["duration_ms"] for call in calls), 3),
+        duration_ms=round(duration * 1000, 3),
+    )
+
+
+class RecordingSession(object):
+    """Wraps the session of a DSS API client (a requests.Session or a PersistentConnectionSession) to record its calls
+
+    The recorder can be replaced, or set to None to stop recording, as the clients are reused by the module runs of a
+    controller process.
+    """
+
+    def __init__(self, session, recorder=None):
+        self._session = session
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def request(self, method, url, *args, **kwargs):
+        recorder = self.recorder
+        if recorder is None:
+            return self._session.request(method, url, *args, **kwargs)
+
+        status = None
+        bytes_received = 0
+        start = time.perf_counter()
+        try:
+            response = self._session.request(method, url, *args, **kwargs)
+            status = response.status_code
+            bytes_received = _get_response_size(response, kwargs.get("stream", False))
+            return response
+        finally:
+            recorder.record(method, url, status, _get_body_size(kwargs.get("data")), bytes_received,
+                            time.perf_counter() - start)
+
+
+def _get_body_size(data):
+    if isinstance(data, bytes):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode("UTF-8"))
+    return 0
+
+
+def _get_response_size(response, stream):
+    # The content of a streamed response is read later by the caller
+    if stream:
+        return int(response.headers.get("Content-Length") or 0)
+    return len(response.content)
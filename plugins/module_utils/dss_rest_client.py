@@ -0,0 +1,392 @@
+import json
+import time
+import traceback
+
+# Import Error handling required du to ansible sanity checks handling of non-default python libraries
+# https://docs.ansible.com/ansible/latest/dev_guide/testing/sanity/import.html
+try:
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+    from requests.auth import HTTPBasicAuth
+    from urllib3.util.retry import Retry
+except ImportError:
+    # Only for the classes below to be defined, the modules fail on HAS_REQUESTS_LIBRARY before using them
+    HTTPAdapter = object
+    HAS_REQUESTS_LIBRARY = False
+    REQUESTS_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_REQUESTS_LIBRARY = True
+    REQUESTS_IMPORT_ERROR = None
+
+# Connections kept open to the DSS by a client, it only sends one request at a time
+POOL_MAXSIZE = 2
+# Default transport options of the clients, see configure_session. There is no default read timeout, as some calls
+# wait for long DSS tasks (ex: a code env build)
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+# Statuses returned by a proxy or load balancer in front of a DSS which is restarting or overloaded
+RETRY_STATUSES = (502, 503, 504)
+# Bounds of the exponential backoff used to poll the DSS futures, in seconds
+FUTURE_POLL_MIN_DELAY = 0.5
+FUTURE_POLL_MAX_DELAY = 10
+
+
+class DataikuException(Exception):
+    """An error returned by the DSS API, with the same message as the one raised by dataikuapi"""
+
+
+class DSSHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter applying a default timeout to the requests sent without one, as the DSS API clients do"""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super(DSSHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super(DSSHTTPAdapter, self).send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+def configure_session(session, ca_bundle=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=None,
+                      retries=DEFAULT_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF, pool_maxsize=POOL_MAXSIZE):
+    """Sets the transport options on the requests.Session of a DSS API client (DSSClient, GovernClient or DSSRestClient)
+
+    The connections of the pool are kept alive, so an HTTPS connection only does its TLS handshake once for all the
+    calls of the client. The idempotent calls (ex: GET, PUT) are retried with an exponential backoff on connection
+    errors and on RETRY_STATUSES, the last response being returned to the client to raise its usual error.
+    """
+    retry = Retry(total=retries, backoff_factor=retry_backoff, status_forcelist=RETRY_STATUSES, raise_on_status=False)
+    adapter = DSSHTTPAdapter(
+        timeout=(connect_timeout, read_timeout), pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if ca_bundle is not None:
+        session.verify = ca_bundle
+
+
+class DSSRestClient(object):
+    """A minimal client of the DSS public API, used by the modules when dataikuapi is not available
+
+    Only the calls needed by the modules of this collection are implemented, with the same names and
+    results as their dataikuapi counterparts. It works for the design, automation, deployer and govern nodes.
+    """
+
+    def __init__(self, host, api_key=None):
+        self.host = host
+        self.api_key = api_key
+        self._session = Session()
+        configure_session(self._session)
+        if api_key is not None:
+            self._session.auth = HTTPBasicAuth(api_key, "")
+
+    def _perform_http(self, method, path, params=None, body=None, files=None):
+        if body is not None:
+            body = json.dumps(body)
+        response = self._session.request(
+            method, f"{self.host}/dip/publicapi{path}", params=params, data=body, files=files
+        )
+        if response.status_code >= 400:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {"message": response.text}
+            raise DataikuException("%s: %s" % (
+                error.get("errorType", "Unknown error"),
+                error.get("detailedMessage", error.get("message", "No message")),
+            ))
+        return response
+
+    def _perform_empty(self, method, path, params=None, body=None, files=None):
+        self._perform_http(method, path, params=params, body=body, files=files)
+
+    def _perform_text(self, method, path, params=None, body=None, files=None):
+        return self._perform_http(method, path, params=params, body=body, files=files).text
+
+    def _perform_json(self, method, path, params=None, body=None, files=None):
+        return self._perform_http(method, path, params=params, body=body, files=files).json()
+
+    def get_instance_info(self):
+        return DSSInstanceInfo(self._perform_json("GET", "/instance-info"))
+
+    # Users and groups
+
+    def get_user(self, login):
+        return DSSUser(self, login)
+
+    def create_user(self, login, password, display_name="", source_type="LOCAL", groups=None,
+                    profile="DATA_SCIENTIST", email=None):
+        self._perform_text("POST", "/admin/users/", body={
+            "login": login,
+            "password": password,
+            "displayName": display_name,
+            "sourceType": source_type,
+            "groups": groups if groups is not None else [],
+            "userProfile": profile,
+            "email": email,
+        })
+        return DSSUser(self, login)
+
+    def get_group(self, name):
+        return DSSGroup(self, name)
+
+    def create_group(self, name, description=None, source_type="LOCAL"):
+        self._perform_text("POST", "/admin/groups/", body={
+            "name": name,
+            "description": description,
+            "sourceType": source_type,
+        })
+        return DSSGroup(self, name)
+
+    # Connections and settings
+
+    def get_connection(self, name):
+        return DSSConnection(self, name)
+
+    def create_connection(self, name, type, params=None, usable_by="ALL", allowed_groups=None, description=None):
+        self._perform_text("POST", "/admin/connections/", body={
+            "name": name,
+            "description": description,
+            "type": type,
+            "params": params if params is not None else {},
+            "usableBy": usable_by,
+            "allowedGroups": allowed_groups if allowed_groups is not None else [],
+        })
+        return DSSConnection(self, name)
+
+    def get_general_settings(self):
+        return DSSGeneralSettings(self)
+
+    # Code envs
+
+    def list_code_envs(self):
+        return self._perform_json("GET", "/admin/code-envs/")
+
+    def get_code_env(self, env_lang, env_name):
+        return DSSCodeEnv(self, env_lang, env_name)
+
+    def create_code_env(self, env_lang, env_name, deployment_mode, params=None):
+        body = params if params is not None else {}
+        body["deploymentMode"] = deployment_mode
+        response = self._perform_json(
+            "POST", f"/admin/code-envs/{env_lang}/{env_name}", params={"wait": True}, body=body
+        )
+        _check_code_env_response(response, "creation")
+        return DSSCodeEnv(self, env_lang, env_name)
+
+    # Plugins
+
+    def list_plugins(self):
+        return self._perform_json("GET", "/plugins/")
+
+    def get_plugin(self, plugin_id):
+        return DSSPlugin(self, plugin_id)
+
+    def start_install_plugin_from_archive(self, fp):
+        return DSSFuture(self, self._perform_json("POST", "/plugins/actions/future/installFromZip", files={"file": fp}))
+
+    def install_plugin_from_store(self, plugin_id):
+        return DSSFuture(self, self._perform_json("POST", "/plugins/actions/installFromStore", body={
+            "pluginId": plugin_id,
+        }))
+
+    def install_plugin_from_git(self, repository_url, checkout="master", subpath=None):
+        return DSSFuture(self, self._perform_json("POST", "/plugins/actions/installFromGit", body={
+            "gitRepositoryUrl": repository_url,
+            "gitCheckout": checkout,
+            "gitSubpath": subpath,
+        }))
+
+    def get_apideployer(self):
+        raise NotImplementedError(
+            "The API deployer is not supported by the built-in DSS client, the dataikuapi package is required"
+        )
+
+
+class DSSInstanceInfo(object):
+    def __init__(self, data):
+        self.raw = data
+
+
+class DSSUser(object):
+    def __init__(self, client, login):
+        self.client = client
+        self.login = login
+
+    def get_settings(self):
+        return DSSUserSettings(self.client, self.login, self.client._perform_json("GET", f"/admin/users/{self.login}"))
+
+    def delete(self, allow_self_deletion=False):
+        self.client._perform_empty(
+            "DELETE", f"/admin/users/{self.login}", params={"allowSelfDeletion": allow_self_deletion}
+        )
+
+
+class DSSUserSettings(object):
+    def __init__(self, client, login, settings):
+        self.client = client
+        self.login = login
+        self.settings = settings
+
+    def get_raw(self):
+        return self.settings
+
+    def save(self):
+        self.client._perform_json("PUT", f"/admin/users/{self.login}", body=self.settings)
+
+
+class DSSGroup(object):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_definition(self):
+        return self.client._perform_json("GET", f"/admin/groups/{self.name}")
+
+    def set_definition(self, definition):
+        return self.client._perform_json("PUT", f"/admin/groups/{self.name}", body=definition)
+
+    def delete(self):
+        self.client._perform_empty("DELETE", f"/admin/groups/{self.name}")
+
+
+class DSSConnection(object):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_definition(self):
+        return self.client._perform_json("GET", f"/admin/connections/{self.name}")
+
+    def set_definition(self, definition):
+        return self.client._perform_json("PUT", f"/admin/connections/{self.name}", body=definition)
+
+    def delete(self):
+        self.client._perform_empty("DELETE", f"/admin/connections/{self.name}")
+
+
+class DSSGeneralSettings(object):
+    def __init__(self, client):
+        self.client = client
+        self.settings = client._perform_json("GET", "/admin/general-settings")
+
+    def get_raw(self):
+        return self.settings
+
+    def save(self):
+        self.client._perform_empty("PUT", "/admin/general-settings", body=self.settings)
+
+
+class DSSCodeEnv(object):
+    def __init__(self, client, env_lang, env_name):
+        self.client = client
+        self.env_lang = env_lang
+        self.env_name = env_name
+
+    def get_definition(self):
+        return self.client._perform_json("GET", f"/admin/code-envs/{self.env_lang}/{self.env_name}")
+
+    def set_definition(self, env):
+        return self.client._perform_json("PUT", f"/admin/code-envs/{self.env_lang}/{self.env_name}", body=env)
+
+    def delete(self):
+        response = self.client._perform_json(
+            "DELETE", f"/admin/code-envs/{self.env_lang}/{self.env_name}", params={"wait": True}
+        )
+        _check_code_env_response(response, "deletion")
+        return response
+
+    def update_packages(self, force_rebuild_env=False, version=None):
+        response = self.client._perform_json(
+            "POST", f"/admin/code-envs/{self.env_lang}/{self.env_name}/packages",
+            params={"forceRebuildEnv": force_rebuild_env, "versionToUpdate": version, "wait": True}
+        )
+        _check_code_env_response(response, "update")
+        return response
+
+    def set_jupyter_support(self, active):
+        response = self.client._perform_json(
+            "POST", f"/admin/code-envs/{self.env_lang}/{self.env_name}/jupyter",
+            params={"active": active, "wait": True}
+        )
+        _check_code_env_response(response, "update")
+        return response
+
+
+class DSSPlugin(object):
+    def __init__(self, client, plugin_id):
+        self.client = client
+        self.plugin_id = plugin_id
+
+    def get_settings(self):
+        return DSSPluginSettings(
+            self.client, self.plugin_id, self.client._perform_json("GET", f"/plugins/{self.plugin_id}/settings")
+        )
+
+    def create_code_env(self, python_interpreter=None, conda=False):
+        return DSSFuture(self.client, self.client._perform_json(
+            "POST", f"/plugins/{self.plugin_id}/code-env/actions/create", body={
+                "deploymentMode": "PLUGIN_MANAGED",
+                "conda": conda,
+                "pythonInterpreter": python_interpreter,
+            }
+        ))
+
+    def update_from_zip(self, fp):
+        self.client._perform_json("POST", f"/plugins/{self.plugin_id}/actions/updateFromZip", files={"file": fp})
+
+    def update_from_store(self):
+        return DSSFuture(self.client, self.client._perform_json(
+            "POST", f"/plugins/{self.plugin_id}/actions/updateFromStore"
+        ))
+
+    def update_from_git(self, repository_url, checkout="master", subpath=None):
+        return DSSFuture(self.client, self.client._perform_json(
+            "POST", f"/plugins/{self.plugin_id}/actions/updateFromGit", body={
+                "gitRepositoryUrl": repository_url,
+                "gitCheckout": checkout,
+                "gitSubpath": subpath,
+            }
+        ))
+
+    def delete(self, force=False):
+        return DSSFuture(self.client, self.client._perform_json(
+            "POST", f"/plugins/{self.plugin_id}/actions/delete", body={"force": force}
+        ))
+
+
+class DSSPluginSettings(object):
+    def __init__(self, client, plugin_id, settings):
+        self.client = client
+        self.plugin_id = plugin_id
+        self.settings = settings
+
+    def get_raw(self):
+        return self.settings
+
+    def save(self):
+        self.client._perform_empty("POST", f"/plugins/{self.plugin_id}/settings", body=self.settings)
+
+
+class DSSFuture(object):
+    """A long running DSS task, started with the state returned by the call that created it"""
+
+    def __init__(self, client, state):
+        self.client = client
+        self.state = state
+        self.job_id = state.get("jobId")
+
+    def wait_for_result(self):
+        delay = FUTURE_POLL_MIN_DELAY
+        while not self.state.get("hasResult", False):
+            time.sleep(delay)
+            delay = min(delay * 2, FUTURE_POLL_MAX_DELAY)
+            self.state = self.client._perform_json("GET", f"/futures/{self.job_id}", params={"peek": False})
+        return self.state.get("result")
+
+
+def _check_code_env_response(response, operation):
+    if response is None:
+        raise Exception(f"Env {operation} returned no data")
+    if response.get("messages", {}).get("error", False):
+        raise Exception(f"Env {operation} failed : {json.dumps(response.get('messages', {}).get('messages', {}))}")
@@ -82,6 +82,9 @@ options:
         description:
             - The URL of the Carbon API server in which API Nodes metrics can be found
         required: false
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -131,6 +134,12 @@ changed:
     returned: on success
     description: whether changes were made
     type: bool
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
 import copy
@@ -141,7 +150,9 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     add_dss_connection_args,
     get_client_from_parsed_args,
+    set_perf_phase,
     bootstrap_dataiku_module,
+    uses_builtin_client,
 )
 
 supported_node_types = ["design", "deployer"]
@@ -162,6 +173,9 @@ def run_module():
 
     module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
     bootstrap_dataiku_module(module)
+    # The built-in DSS client does not implement the API Deployer
+    if uses_builtin_client():
+        module.fail_json(msg="The dss_api_deployer_infra module requires the dataikuapi package on the managed host")
 
     args = MakeNamespace(module.params)
     result = dict(changed=False, message="UNCHANGED", id=args.id, )
@@ -172,6 +186,7 @@ def run_module():
     infra = None
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
+        set_perf_phase(module, "read")
         api_deployer = client.get_apideployer()
         infras_status = api_deployer.list_infras(as_objects=False)
         infras_id = []
@@ -181,6 +196,7 @@ def run_module():
         if not exists and args.state == "present":
             create = True
 
+        set_perf_phase(module, "diff")
         result["changed"] = create or (exists and args.state == "absent")
         if result["changed"]:
             if create:
@@ -196,6 +212,7 @@ def run_module():
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if args.state == "present":
             if create:
                 infra = api_deployer.create_infra(args.id, args.stage, args.type)
@@ -131,6 +131,9 @@ options:
             - Is the code env supposed to be there or not. Either "present" or "absent". Default "present"
         required: false
         default: "present"
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -186,9 +189,19 @@ changed:
     returned: on success
     description: whether changes were made
     type: bool
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new code env definition
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
-import copy
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
@@ -196,8 +209,14 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     add_dss_connection_args,
     get_client_from_parsed_args,
+    set_perf_phase,
     bootstrap_dataiku_module,
     update,
+    cached_api_read,
+    invalidate_api_cache,
+    diff_structures,
+    set_result_changes,
+    SettingsOverlay,
 )
 
 
@@ -284,7 +303,8 @@ def run_module():
 
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
-        code_envs = client.list_code_envs()
+        set_perf_phase(module, "read")
+        code_envs = cached_api_read(module, client, "code-envs", "/admin/code-envs/", client.list_code_envs)
 
         # Check existence
         for env in code_envs:
@@ -327,11 +347,13 @@ def run_module():
                             code_env_def["desc"]["installJupyterSupport"]:
                         update_packages = True
 
-        new_code_env_def = copy.deepcopy(code_env_def)
+        set_perf_phase(module, "diff")
+        new_code_env_def = SettingsOverlay(code_env_def)
         update(new_code_env_def, required_code_env_def)
 
         # Prepare the result for dry-run mode
-        result["changed"] = create or (exists and args.state == "absent") or (args.state == "present" and new_code_env_def != code_env_def)
+        changes = set_result_changes(module, result, code_env_def, new_code_env_def if args.state == "present" else None)
+        result["changed"] = create or (exists and args.state == "absent") or (args.state == "present" and bool(changes))
         if result["changed"]:
             if create:
                 result["message"] = "CREATED"
@@ -339,7 +361,7 @@ def run_module():
                 if args.state == "absent":
                     result["message"] = "DELETED"
                 else:
-                    if code_env_def != new_code_env_def:
+                    if changes:
                         result["message"] = "MODIFIED"
                     else:
                         result["message"] = "UNMODIFIED"
@@ -348,6 +370,7 @@ def run_module():
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if args.state == "present":
             if create:
                 if args.deployment_mode is None:
@@ -357,19 +380,24 @@ def run_module():
                 if args.version is not None:
                     raise Exception("Creating versioned code environments is not supported")
                 code_env = client.create_code_env(args.lang, args.name, args.deployment_mode, required_code_env_def)
+                invalidate_api_cache(module, client, "code-envs")
                 code_env_def = code_env.get_definition()
-                new_code_env_def = copy.deepcopy(code_env_def)
+                new_code_env_def = SettingsOverlay(code_env_def)
                 update(new_code_env_def, required_code_env_def)
+                changes = diff_structures(code_env_def, new_code_env_def)
 
-            if new_code_env_def != code_env_def:
-                code_env.set_definition(new_code_env_def)
+            if changes:
+                code_env.set_definition(new_code_env_def.materialize())
+                invalidate_api_cache(module, client, "code-envs")
                 result["changed"] = True
 
             if (args.update or create or update_packages) and "NON_MANAGED" not in args.deployment_mode:
                 code_env.update_packages(version=args.version)
+                invalidate_api_cache(module, client, "code-envs")
 
             if args.jupyter_support:
                 code_env.set_jupyter_support(args.jupyter_support)
+                invalidate_api_cache(module, client, "code-envs")
 
             code_env_def = code_env.get_definition()
             result["dss_code_env"] = code_env_def
@@ -377,6 +405,7 @@ def run_module():
         if args.state == "absent" and exists:
             if exists:
                 code_env.delete()
+                invalidate_api_cache(module, client, "code-envs")
 
         module.exit_json(**result)
     except Exception as e:
@@ -72,6 +72,9 @@ options:
             - possible through the public API only.
         required: false
         default: false
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -130,9 +133,19 @@ changed:
     returned: on success
     description: whether changes were made
     type: bool
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new connection definition, without its encrypted fields
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
-import copy
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
@@ -140,8 +153,12 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     add_dss_connection_args,
     get_client_from_parsed_args,
+    set_perf_phase,
     bootstrap_dataiku_module,
+    get_dataiku_exception_class,
+    set_result_changes,
     update,
+    SettingsOverlay,
 )
 
 supported_node_types = ["design", "automation", "deployer"]
@@ -183,7 +200,7 @@ def run_module():
 
     module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
     bootstrap_dataiku_module(module)
-    from dataikuapi.utils import DataikuException
+    DataikuException = get_dataiku_exception_class()
 
     args = MakeNamespace(module.params)
     if args.state not in ["present", "absent"]:
@@ -196,6 +213,7 @@ def run_module():
 
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
+        set_perf_phase(module, "read")
         exists = True
         create = False
         connection = client.get_connection(args.name)
@@ -237,8 +255,9 @@ def run_module():
                 # .format(args.name,mandatory_create_param))
                 pass
 
+        set_perf_phase(module, "diff")
         # Build the new definition
-        new_def = copy.deepcopy(current_def) if exists else connection_template  # Used for modification
+        new_def = SettingsOverlay(current_def if exists else connection_template)  # Used for modification
 
         # Apply every attribute except the password for now
         new_def["name"] = args.name
@@ -253,26 +272,29 @@ def run_module():
                 del new_def["params"][field]
 
         # Prepare the result for dry-run mode
-        result["changed"] = create or (exists and args.state == "absent") or (exists and current_def != new_def)
+        changes = set_result_changes(module, result, current_def, new_def if args.state == "present" else None)
+        result["changed"] = create or (exists and args.state == "absent") or (exists and bool(changes))
         if result["changed"]:
             if create:
                 result["message"] = "CREATED"
             elif exists:
                 if args.state == "absent":
                     result["message"] = "DELETED"
-                elif current_def != new_def:
+                elif changes:
                     result["message"] = "MODIFIED"
 
         if args.state == "present":
-            result["connection_def"] = new_def
+            result["connection_def"] = new_def.materialize()
 
         if module.check_mode:
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if result["changed"] or (0 < len(encrypted_fields["params"].keys()) and exists):
             if create:
                 update(new_def, encrypted_fields)
+                new_def = result["connection_def"] = new_def.materialize()
                 connection = client.create_connection(args.name, type, new_def["params"])
                 def_after_creation = connection.get_definition()
                 update(def_after_creation, new_def)
@@ -280,7 +302,7 @@ def run_module():
             elif exists:
                 if args.state == "absent":
                     connection.delete()
-                elif current_def != new_def or (0 < len(encrypted_fields["params"].keys()) and not args.set_encrypted_fields_at_creation_only):
+                elif changes or (0 < len(encrypted_fields["params"].keys()) and not args.set_encrypted_fields_at_creation_only):
                     for field in encrypted_fields_list:
                         new_def_value = encrypted_fields["params"].get(field, None)
                         previous_def_value = encrypted_fields_before_change.get(field)
@@ -288,6 +310,7 @@ def run_module():
                             new_def["params"][field] = new_def_value
                         elif previous_def_value:
                             new_def["params"][field] = previous_def_value
+                    new_def = result["connection_def"] = new_def.materialize()
                     connection.set_definition(new_def)
                     result["message"] = "MODIFIED"
                     if 0 < len(encrypted_fields["params"]):
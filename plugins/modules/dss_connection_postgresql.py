@@ -94,6 +94,9 @@ options:
             - Wether the connection is supposed to exist or not. Possible values are "present" and "absent"
         default: present
         required: false
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -138,9 +141,19 @@ changed:
     returned: on success
     description: whether changes were made
     type: bool
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new connection definition
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
-import copy
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
@@ -148,8 +161,12 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     add_dss_connection_args,
     get_client_from_parsed_args,
+    set_perf_phase,
     bootstrap_dataiku_module,
+    get_dataiku_exception_class,
+    set_result_changes,
     update,
+    SettingsOverlay,
 )
 
 supported_node_types = ["design", "automation", "deployer"]
@@ -202,7 +219,7 @@ def run_module():
 
     module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
     bootstrap_dataiku_module(module)
-    from dataikuapi.utils import DataikuException
+    DataikuException = get_dataiku_exception_class()
 
     args = MakeNamespace(module.params)
     if args.state not in ["present", "absent"]:
@@ -214,6 +231,7 @@ def run_module():
 
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
+        set_perf_phase(module, "read")
         exists = True
         create = False
         connection = client.get_connection(args.name)
@@ -248,8 +266,9 @@ def run_module():
                             )
                         )
 
+        set_perf_phase(module, "diff")
         # Build the new definition
-        new_def = copy.deepcopy(current_def) if exists else connection_template  # Used for modification
+        new_def = SettingsOverlay(current_def if exists else connection_template)  # Used for modification
 
         # Apply every attribute except the password for now
         new_def["name"] = args.name
@@ -266,23 +285,25 @@ def run_module():
         update(new_def, args.additional_args)
 
         # Prepare the result for dry-run mode
-        result["changed"] = create or (exists and args.state == "absent") or (exists and current_def != new_def)
+        changes = set_result_changes(module, result, current_def, new_def if args.state == "present" else None)
+        result["changed"] = create or (exists and args.state == "absent") or (exists and bool(changes))
         if result["changed"]:
             if create:
                 result["message"] = "CREATED"
             elif exists:
                 if args.state == "absent":
                     result["message"] = "DELETED"
-                elif current_def != new_def:
+                elif changes:
                     result["message"] = "MODIFIED"
 
         if args.state == "present":
-            result["connection_def"] = new_def
+            result["connection_def"] = new_def.materialize()
 
         if module.check_mode:
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if result["changed"] or (args.password is not None and exists):
             if create:
                 new_def["params"]["password"] = args.password
@@ -295,13 +316,15 @@ def run_module():
                 if args.postgresql_port is not None:
                     params["port"] = args.postgresql_port
                 connection = client.create_connection(args.name, connection_template["type"], params)
+                new_def = result["connection_def"] = new_def.materialize()
                 connection.set_definition(new_def)  # 2nd call to apply additional parameters
             elif exists:
                 if args.state == "absent":
                     connection.delete()
-                elif current_def != new_def or args.password is not None:
+                elif changes or args.password is not None:
                     if args.password is not None:
                         new_def["params"]["password"] = args.password
+                    new_def = result["connection_def"] = new_def.materialize()
                     connection.set_definition(new_def)
                     if result["changed"]:
                         result["message"] = "MODIFIED"
@@ -59,14 +59,25 @@ options:
               and spark exec configs will be updated based on the 'name' key. The module will iterate over the existing exec configs
               and update the ones that have matching 'name' keys, else append them to the list. Warning, when enabled, it is not possible
               to delete an exec config using ansible.
+            - The other named lists to update this way are set with O(smart_update_lists).
         default: true
         required: false
+    smart_update_lists:
+        type: dict
+        description:
+            - "Additional named lists to smart update, when O(enable_smart_update) is true. The keys are the dotted paths of the lists
+              in the settings, the values the key their elements are matched on, for instance C(sparkSettings.executionConfigs: name)."
+            - They are added to the container and spark exec configs, whose key can also be changed here.
+        required: false
     settings:
         type: dict
         description:
             - General settings values to modify. Can be ignored to just get the current values.
         required: false
         default: {}
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -121,10 +132,20 @@ changed:
     returned: on success
     description: whether changes were made
     type: bool
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new settings
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
 import traceback
-import copy
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
@@ -132,29 +153,32 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     add_dss_connection_args,
     extract_keys,
     get_client_from_parsed_args,
+    set_perf_phase,
     bootstrap_dataiku_module,
     update,
-    exclude_keys,
-    smart_update_named_lists,
-    build_template_from_fields
+    KeySelector,
+    smart_update_named_lists_at_paths,
+    diff_structures,
+    build_diff_output,
 )
 
 supported_node_types = ["design", "automation", "deployer", "govern"]
-encrypted_fields = [
+encrypted_fields = KeySelector([
     "ldapSettings.bindPassword", "ssoSettings.samlSPParams.keystorePassword", "ssoSettings.openIDParams.clientSecret",
     "azureADSettings.credentialsClientSecret", "azureADSettings.credentialsCertificatePassword"
-]
-smart_update_fields = [
-    "containerSettings.executionConfigs", "sparkSettings.executionConfigs"
-]
-smart_update_fields_template = build_template_from_fields(smart_update_fields, default_value=[])
+])
+default_smart_update_lists = {
+    "containerSettings.executionConfigs": "name",
+    "sparkSettings.executionConfigs": "name",
+}
 
 
 def run_module():
     module_args = dict(
         settings=dict(type="dict", required=False, default={}),
         silent_update_secrets=dict(type="bool", required=False, default=True),
-        enable_smart_update=dict(type="bool", required=False, default=True)
+        enable_smart_update=dict(type="bool", required=False, default=True),
+        smart_update_lists=dict(type="dict", required=False, default=None),
     )
     add_dss_connection_args(module_args)
 
@@ -169,8 +193,10 @@ def run_module():
     general_settings = None
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
+        set_perf_phase(module, "read")
         general_settings = client.get_general_settings()
 
+        set_perf_phase(module, "diff")
         current_settings = extract_keys(general_settings.settings, args.settings)
         new_settings = args.settings
 
@@ -178,35 +204,39 @@ def run_module():
         result["previous_settings"] = current_settings
         result["dss_general_settings"] = general_settings.settings
 
-        smart_update_fields_changed = False
+        smart_update_changes = []
         if args.enable_smart_update:
-            # Extract execution configs from regular settings
-            current_values = exclude_keys(current_settings, smart_update_fields)
-            new_settings = exclude_keys(args.settings, smart_update_fields)
-
-            # Smart update of execution configs
-            current_smart_update_fields = extract_keys(general_settings.settings, smart_update_fields_template)
-            new_smart_update_fields = extract_keys(args.settings, smart_update_fields_template)
-            updated_smart_update_fields = copy.deepcopy(current_smart_update_fields)
-            for key in new_smart_update_fields.keys():
-                if new_smart_update_fields[key]["executionConfigs"]:
-                    updated_smart_update_fields[key]["executionConfigs"] = smart_update_named_lists(
-                        current_smart_update_fields[key]["executionConfigs"],
-                        new_smart_update_fields[key]["executionConfigs"]
-                    ) or []
-            smart_update_fields_changed = current_smart_update_fields != updated_smart_update_fields
+            smart_update_lists = dict(default_smart_update_lists, **(args.smart_update_lists or {}))
+            smart_update_fields = KeySelector(smart_update_lists.keys())
+
+            # Extract named lists from regular settings
+            current_values = smart_update_fields.exclude(current_settings)
+            new_settings = smart_update_fields.exclude(args.settings)
+
+            # Smart update of named lists
+            current_smart_update_fields = smart_update_named_lists_at_paths(general_settings.settings, {}, smart_update_lists)
+            updated_smart_update_fields = smart_update_named_lists_at_paths(
+                general_settings.settings, args.settings, smart_update_lists
+            )
+            smart_update_changes = diff_structures(current_smart_update_fields, updated_smart_update_fields)
         else:
             current_values = current_settings
 
         # Process regular settings
         if args.silent_update_secrets:
-            current_values_password_excluded = exclude_keys(current_values, encrypted_fields)
-            new_values_password_excluded = exclude_keys(new_settings, encrypted_fields)
-            settings_changed = current_values_password_excluded != new_values_password_excluded
+            current_values = encrypted_fields.exclude(current_values)
+            settings_changes = diff_structures(current_values, encrypted_fields.exclude(new_settings))
         else:
-            settings_changed = current_values != new_settings
+            settings_changes = diff_structures(current_values, new_settings)
 
-        result["changed"] = smart_update_fields_changed or settings_changed
+        result["changes"] = settings_changes + smart_update_changes
+        if module._diff:
+            result["diff"] = build_diff_output(current_values, settings_changes)
+            if smart_update_changes:
+                smart_update_diff = build_diff_output(current_smart_update_fields, smart_update_changes)
+                result["diff"]["before"].update(smart_update_diff["before"])
+                result["diff"]["after"].update(smart_update_diff["after"])
+        result["changed"] = bool(result["changes"])
         if result["changed"]:
             result["message"] = "MODIFIED"
 
@@ -214,6 +244,7 @@ def run_module():
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if args.enable_smart_update:
             update(general_settings.settings, new_settings)
             update(general_settings.settings, updated_smart_update_fields)
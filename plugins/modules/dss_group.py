@@ -234,6 +234,9 @@ options:
             - Whether the group allows to manage Govern
         required: false
 
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -310,10 +313,20 @@ message:
     returned: on success
     description: CREATED, MODIFIED, UNCHANGED or DELETED
     type: str
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new group definition
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
 import re
-import copy
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
@@ -322,7 +335,12 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     is_version_more_recent,
     add_dss_connection_args,
     get_client_from_parsed_args,
-    bootstrap_dataiku_module
+    set_perf_phase,
+    bootstrap_dataiku_module,
+    get_dataiku_exception_class,
+    cached_api_read,
+    set_result_changes,
+    SettingsOverlay,
 )
 
 supported_node_types = ["design", "automation", "deployer", "govern"]
@@ -381,7 +399,7 @@ def run_module():
 
     module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
     bootstrap_dataiku_module(module)
-    from dataikuapi.utils import DataikuException
+    DataikuException = get_dataiku_exception_class()
 
     args = MakeNamespace(module.params)
     if args.state not in ["present", "absent"]:
@@ -397,8 +415,11 @@ def run_module():
 
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
+        set_perf_phase(module, "read")
         group = client.get_group(args.name)
-        dss_version = client.get_instance_info().raw.get("dssVersion")
+        dss_version = cached_api_read(
+            module, client, "instance-info", "/instance-info", lambda: client.get_instance_info().raw
+        ).get("dssVersion")
         exists = True
         create = False
         current = None
@@ -423,8 +444,9 @@ def run_module():
                     current[setting_name] = ",".join(sorted(current_group_names.split(",")))
                 result["previous_group_def"] = current
 
+        set_perf_phase(module, "diff")
         # Build the new user definition
-        new_def = copy.deepcopy(current) if exists else {}  # Used for modification
+        new_def = SettingsOverlay(current if exists else {})  # Used for modification
 
         # Transform to camel case
         dict_args = {}
@@ -450,23 +472,26 @@ def run_module():
         new_def.update(dict_args)
 
         # Prepare the result for dry-run mode
-        result["changed"] = create or (exists and args.state == "absent") or (exists and current != new_def)
+        changes = set_result_changes(module, result, current if exists else None,
+                                     new_def if args.state == "present" else None)
+        result["changed"] = create or (exists and args.state == "absent") or (exists and bool(changes))
         if result["changed"]:
             if create:
                 result["message"] = "CREATED"
             elif exists:
                 if args.state == "absent":
                     result["message"] = "DELETED"
-                elif current != new_def:
+                elif changes:
                     result["message"] = "MODIFIED"
 
         if args.state == "present":
-            result["group_def"] = new_def
+            result["group_def"] = new_def.materialize()
 
         if module.check_mode:
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if result["changed"]:
             if create:
                 new_group = client.create_group(
@@ -477,13 +502,13 @@ def run_module():
                 # 2nd request mandatory for capabilites TODO: fix the API
                 if "mayWriteSafeCode" not in list(new_def.keys()):
                     new_def["mayWriteSafeCode"] = True
-                new_group.set_definition(new_def)
+                new_group.set_definition(new_def.materialize())
                 result["group_def"] = new_group.get_definition()
             elif exists:
                 if args.state == "absent":
                     group.delete()
-                elif current != new_def:
-                    group.set_definition(new_def)
+                elif changes:
+                    group.set_definition(new_def.materialize())
                     result["message"] = "MODIFIED"
 
         module.exit_json(**result)
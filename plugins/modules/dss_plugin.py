@@ -100,6 +100,9 @@ options:
               not updated, and the code-env is not installed, this will be ineffective.
         required: false
         default: true
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -135,9 +138,19 @@ message:
     returned: on success
     description: CREATED, DELETED, MODIFIED or UNMODIFIED
     type: str
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new plugin settings
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
-import copy
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
@@ -145,8 +158,13 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     add_dss_connection_args,
     get_client_from_parsed_args,
+    set_perf_phase,
     bootstrap_dataiku_module,
     update,
+    cached_api_read,
+    invalidate_api_cache,
+    set_result_changes,
+    SettingsOverlay,
 )
 
 
@@ -182,7 +200,8 @@ def run_module():
     current_settings = {}
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
-        plugins = client.list_plugins()
+        set_perf_phase(module, "read")
+        plugins = cached_api_read(module, client, "plugins", "/plugins/", client.list_plugins)
         plugin_dict = {plugin['id']: plugin for plugin in plugins}
 
         # Check existence
@@ -194,17 +213,19 @@ def run_module():
 
         if exists:
             plugin = client.get_plugin(args.plugin_id)
-            current_settings = copy.deepcopy(plugin.get_settings().get_raw())
+            current_settings = plugin.get_settings().get_raw()
 
+        set_perf_phase(module, "diff")
         # Prepare the result for dry-run mode
-        new_settings = copy.deepcopy(current_settings)
+        new_settings = SettingsOverlay(current_settings)
         if args.settings is not None:
             update(new_settings, args.settings)
+        changes = set_result_changes(module, result, current_settings, new_settings)
 
         result["changed"] = create or (
             exists and (
                 args.state == "absent"
-                or (args.settings is not None and new_settings != current_settings)
+                or (args.settings is not None and bool(changes))
                 or (create_code_env and "codeEnvName" not in current_settings)
             ))
         if result["changed"]:
@@ -223,13 +244,14 @@ def run_module():
             "id": args.plugin_id,
         }
         if exists:
-            result["dss_plugin"]["settings"] = new_settings
+            result["dss_plugin"]["settings"] = new_settings.materialize()
             update(result["dss_plugin"], plugin_dict[args.plugin_id])
 
         if module.check_mode:
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if args.state == "present":
             plugin_desc = {}
             if not exists:
@@ -245,9 +267,10 @@ def run_module():
                     future = client.install_plugin_from_store(args.plugin_id)
                 result["job_results"].append(future.wait_for_result())
                 plugin_desc = result["job_results"][-1].get("pluginDesc")
+                invalidate_api_cache(module, client, "plugins")
 
                 # Required to relist for the meta
-                plugins = client.list_plugins()
+                plugins = cached_api_read(module, client, "plugins", "/plugins/", client.list_plugins)
                 plugin_dict = {plugin['id']: plugin for plugin in plugins}
                 plugin = client.get_plugin(args.plugin_id)
                 update(result["dss_plugin"], plugin_dict[args.plugin_id])
@@ -263,35 +286,39 @@ def run_module():
                     future = plugin.update_from_store()
                 result["job_results"].append(future.wait_for_result())
                 plugin_desc = result["job_results"][-1].get("pluginDesc")
+                invalidate_api_cache(module, client, "plugins")
 
             # Force refetch settings
-            current_settings = copy.deepcopy(plugin.get_settings().get_raw())
-            new_settings = copy.deepcopy(current_settings)
+            current_settings = plugin.get_settings().get_raw()
+            new_settings = SettingsOverlay(current_settings)
             if args.settings is not None:
                 update(new_settings, args.settings)
 
             if "codeEnvSpec" in plugin_desc and args.install_code_env:
                 create_code_env = True
-            result["dss_plugin"]["settings"] = new_settings
 
         code_env_install_result = None
         if args.state == "present" and create_code_env and "codeEnvName" not in new_settings:
             future = plugin.create_code_env()
             code_env_install_result = future.wait_for_result()
+            invalidate_api_cache(module, client, "code-envs")
             new_settings["codeEnvName"] = code_env_install_result.get("envName")
             result["job_results"].append(code_env_install_result)
 
-        if (
-                args.settings is not None or code_env_install_result is not None) and args.state == "present" and new_settings != current_settings:
+        if args.state == "present":
+            changes = set_result_changes(module, result, current_settings, new_settings)
+            new_settings = result["dss_plugin"]["settings"] = new_settings.materialize()
+        if (args.settings is not None or code_env_install_result is not None) and args.state == "present" and changes:
             settings_handle = plugin.get_settings()
             update(settings_handle.settings, new_settings)
             settings_handle.save()
-            result["dss_plugin"]["settings"] = new_settings
+            invalidate_api_cache(module, client, "plugins")
 
         if args.state == "absent" and exists:
             future = plugin.delete(force=args.force)
             if future.job_id is not None:
                 result["job_results"].append(future.wait_for_result())
+            invalidate_api_cache(module, client, "plugins")
 
         module.exit_json(**result)
     except Exception as e:
@@ -97,6 +97,9 @@ options:
         default: present
         required: false
 
+extends_documentation_fragment:
+    - dataiku.dss.dss_transport
+
 author:
     - Jean-Bernard Jansen (jean-bernard.jansen@dataiku.com)
 """
@@ -158,9 +161,19 @@ message:
     returned: on success
     description: CREATED, MODIFIED, UNCHANGED or DELETED
     type: str
+changes:
+    returned: on success
+    description: The JSON Patch operations from the previous to the new user definition
+    type: list
+    elements: dict
+perf:
+    returned: when the dataiku_dss_perf variable or the DATAIKU_ANSIBLE_DSS_PERF env var is true
+    description:
+        - The DSS API calls of the module, with their method, path template, status, bytes and duration
+        - Their totals, and the ones of each phase of the run (bootstrap, read, diff and write)
+    type: dict
 """
 
-import copy
 import traceback
 
 from ansible.module_utils import six
@@ -169,7 +182,11 @@ from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     add_dss_connection_args,
     get_client_from_parsed_args,
-    bootstrap_dataiku_module
+    set_perf_phase,
+    bootstrap_dataiku_module,
+    get_dataiku_exception_class,
+    set_result_changes,
+    SettingsOverlay,
 )
 
 supported_node_types = ["design", "automation", "deployer", "govern"]
@@ -191,7 +208,7 @@ def run_module():
 
     module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
     bootstrap_dataiku_module(module)
-    from dataikuapi.utils import DataikuException
+    DataikuException = get_dataiku_exception_class()
 
     args = MakeNamespace(module.params)
     if args.state not in ["present", "absent"]:
@@ -203,6 +220,7 @@ def run_module():
 
     try:
         client = get_client_from_parsed_args(module, supported_node_types)
+        set_perf_phase(module, "read")
         user = client.get_user(args.login)
         user_exists = True
         create_user = False
@@ -240,10 +258,11 @@ def run_module():
         if args.groups is None and create_user:
             args.groups = module.params["groups"] = ["readers"]
 
+        set_perf_phase(module, "diff")
         # Build the new user definition
         # TODO: be careful that the key names changes between creation and edition
-        new_user_def = copy.deepcopy(current_user_def) if user_exists else {}  # Used for modification
-        result["previous_user_def"] = copy.deepcopy(new_user_def)
+        new_user_def = SettingsOverlay(current_user_def if user_exists else {})  # Used for modification
+        result["previous_user_def"] = dict(current_user_def) if user_exists else {}
         for key, api_param in [
             ("email", "email"),
             ("display_name", "displayName"),
@@ -261,30 +280,32 @@ def run_module():
 
         # Sort groups list before comparison as they should be considered sets
         new_user_def.get("groups", []).sort()
-        if user_exists:
-            current_user_def.get("groups", []).sort()
+        if user_exists and "groups" in current_user_def:
+            current_user_def["groups"] = sorted(current_user_def["groups"])
 
         # Prepare the result for dry-run mode
-        result["changed"] = (
-            create_user or (user_exists and args.state == "absent") or (user_exists and current_user_def != new_user_def)
+        changes = set_result_changes(
+            module, result, current_user_def if user_exists else None, new_user_def if args.state == "present" else None
         )
+        result["changed"] = create_user or (user_exists and args.state == "absent") or (user_exists and bool(changes))
         if result["changed"]:
             if create_user:
                 result["message"] = "CREATED"
             elif user_exists:
                 if args.state == "absent":
                     result["message"] = "DELETED"
-                elif current_user_def != new_user_def:
+                elif changes:
                     result["message"] = "MODIFIED"
 
         # Can be useful to register info from a playbook and act on it
         if args.state == "present":
-            result["user_def"] = new_user_def
+            result["user_def"] = new_user_def.materialize()
 
         if module.check_mode:
             module.exit_json(**result)
 
         # Apply the changes
+        set_perf_phase(module, "write")
         if result["changed"]:
             if create_user:
                 create_excluded_keys = ["email"]
@@ -293,7 +314,7 @@ def run_module():
                     if new_user_def.get(create_excluded_key, None) is not None:
                         create_excluded_values[create_excluded_key] = new_user_def[create_excluded_key]
                         del new_user_def[create_excluded_key]
-                new_user = client.create_user(args.login, args.password, **new_user_def)
+                new_user = client.create_user(args.login, args.password, **new_user_def.materialize())
                 if module.params.get("email", None) is not None:
                     new_user_def_mod = new_user.get_settings()
                     new_user_def_mod.get_raw().update(create_excluded_values)
@@ -301,8 +322,8 @@ def run_module():
             elif user_exists:
                 if args.state == "absent":
                     user.delete()
-                elif current_user_def != new_user_def:
-                    current_user_def.update(new_user_def)
+                elif changes:
+                    current_user_def.update(new_user_def.materialize())
                     current_user_settings.save()
                     result["message"] = "MODIFIED"
 
@@ -0,0 +1,106 @@
+import contextlib
+import importlib
+import io
+import json
+import os
+import tempfile
+import traceback
+
+from ansible.module_utils import basic
+from ansible.module_utils.common.text.converters import to_bytes
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
+from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import API_CACHE_DIR_PREFIX
+
+display = Display()
+
+
+class DssModuleActionBase(ActionBase):
+    """Runs a REST-only DSS module in the controller process when its task runs locally.
+
+    The modules only talk to the DSS API, so when the connection is local (ex: delegate_to: localhost), there is
+    no need to build an AnsiballZ payload and to start a new interpreter. The module is imported and its main()
+    is run with the task arguments, the result being read from what it prints like for a remote run.
+    Otherwise, or when the dataiku_dss_in_process variable is false, the module is executed as usual.
+
+    When the dataiku_dss_api_cache variable is true, the module reads are cached in a directory of the play, see
+    cached_api_read in dataiku_utils. When the dataiku_dss_perf variable is true, the modules return the totals of their
+    DSS API calls as perf, see start_api_call_recording in dataiku_utils.
+    """
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+        result = super(DssModuleActionBase, self).run(tmp, task_vars)
+        del tmp
+
+        module_name = self._task.action.split(".")[-1]
+        in_process = self._can_run_in_process(task_vars)
+        self._set_module_environment(task_vars, in_process)
+        if in_process:
+            display.vvv(f"Running {module_name} in the controller process", host=self._play_context.remote_addr)
+            result.update(self._run_module_in_process(module_name, task_vars))
+        else:
+            result.update(self._execute_module(task_vars=task_vars))
+        return result
+
+    def _can_run_in_process(self, task_vars):
+        if not boolean(task_vars.get("dataiku_dss_in_process", True), strict=False):
+            return False
+        # The controller process cannot become another user
+        if self._connection.become:
+            return False
+        return self._connection.transport in ("local", "ansible.builtin.local")
+
+    def _set_module_environment(self, task_vars, in_process):
+        module_environment = self._get_api_cache_environment(task_vars, in_process)
+        if boolean(task_vars.get("dataiku_dss_perf", False), strict=False):
+            module_environment["DATAIKU_ANSIBLE_DSS_PERF"] = "true"
+        if not module_environment:
+            return
+
+        # First, so that the environment set on the task or the play takes precedence
+        environment = self._task.environment or []
+        if not isinstance(environment, list):
+            environment = [environment]
+        self._task.environment = [module_environment] + environment
+
+    def _get_api_cache_environment(self, task_vars, in_process):
+        if not boolean(task_vars.get("dataiku_dss_api_cache", False), strict=False):
+            return {}
+        base_dir = task_vars.get("dataiku_dss_api_cache_dir") or (tempfile.gettempdir() if in_process else "/tmp")
+        cache_environment = {
+            "DATAIKU_ANSIBLE_DSS_CACHE_DIR": os.path.join(base_dir, f"{API_CACHE_DIR_PREFIX}{self._task.get_play()._uuid}"),
+        }
+        if task_vars.get("dataiku_dss_api_cache_ttl") is not None:
+            cache_environment["DATAIKU_ANSIBLE_DSS_CACHE_TTL"] = str(task_vars["dataiku_dss_api_cache_ttl"])
+        return cache_environment
+
+    def _run_module_in_process(self, module_name, task_vars):
+        module_args = self._task.args.copy()
+        self._update_module_args(module_name, module_args, task_vars)
+        environment = dict()
+        self._compute_environment_string(environment)
+
+        module = importlib.import_module(f"ansible_collections.dataiku.dss.plugins.modules.{module_name}")
+        stdout = io.StringIO()
+        previous_environment = os.environ.copy()
+        basic._ANSIBLE_ARGS = to_bytes(json.dumps({"ANSIBLE_MODULE_ARGS": module_args}))
+        try:
+            os.environ.update({key: str(value) for key, value in environment.items()})
+            with contextlib.redirect_stdout(stdout):
+                try:
+                    module.main()
+                except SystemExit:
+                    # exit_json and fail_json always exit, after the result was printed
+                    pass
+        except Exception as e:
+            return dict(failed=True, msg=f"Failed to run {module_name} in the controller process: {e}",
+                        exception=traceback.format_exc())
+        finally:
+            basic._ANSIBLE_ARGS = None
+            os.environ.clear()
+            os.environ.update(previous_environment)
+
+        return self._parse_returned_data({"stdout": stdout.getvalue(), "stderr": "", "rc": 0})
@@ -0,0 +1,136 @@
+"""Measures the fm_dss inventory plugin against a local Fleet Manager stub.
+
+For each fleet size, a stub FM is started in a separate process and the inventory is parsed.
+The parse wall time, the number of requests received by the FM and the peak memory
+allocated by the parse are reported.
+
+The collection must be importable, for instance when it is installed in a collections path:
+
+    cd ~/.ansible/collections/ansible_collections/dataiku/dss
+    python tests/performance/fm_dss_benchmark.py --sizes 10 1000 10000 --latency 0.005
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+import yaml
+
+STUB_SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "unit", "plugins", "inventory",
+                                "fm_stub_server.py")
+DEFAULT_COLLECTIONS_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", ".."))
+
+
+def start_stub(instances, latency, error_rate):
+    process = subprocess.Popen(
+        [sys.executable, STUB_SERVER_PATH, "--instances", str(instances), "--latency", str(latency),
+         "--error-rate", str(error_rate), "--error-endpoint", "instances/{id}/status", "--port", "0"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # The stub prints the URL it listens to once it is ready
+    url = process.stdout.readline().strip().rsplit(" ", 1)[-1]
+    return process, url
+
+
+def get_stub_stats(url):
+    with urllib.request.urlopen(f"{url}/__stub__/stats") as response:
+        return json.load(response)
+
+
+def run_benchmark(size, args, workdir):
+    process, url = start_stub(size, args.latency, args.error_rate)
+    try:
+        port = url.rsplit(":", 1)[-1]
+        key_file = os.path.join(workdir, "fm.json")
+        with open(key_file, "w") as file:
+            json.dump({"id": "key", "secret": "secret"}, file)
+        config_file = os.path.join(workdir, "benchmark.fm_dss.yml")
+        config = {
+            "plugin": "dataiku.dss.fm_dss",
+            "status_concurrency": args.status_concurrency,
+            "dataiku_fleet_managers": [{
+                "id": "benchmark",
+                "host": "127.0.0.1",
+                "port": port,
+                "protocol": "http",
+                "instances": {"ssh": {"user": "centos"}},
+                "api_key": {"file": key_file},
+            }],
+        }
+        config.update(args.options)
+        with open(config_file, "w") as file:
+            yaml.safe_dump(config, file)
+
+        from ansible.inventory.data import InventoryData
+        from ansible.parsing.dataloader import DataLoader
+        from ansible.plugins.loader import inventory_loader
+
+        def parse():
+            inventory = InventoryData()
+            plugin = inventory_loader.get("dataiku.dss.fm_dss")
+            if not args.verbose:
+                logging.getLogger(plugin.__module__).setLevel(logging.WARNING)
+            plugin.parse(inventory, DataLoader(), config_file, cache=False)
+            return inventory
+
+        # Tracing allocations slows the parse down a lot, so the memory is measured on a second parse
+        start = time.perf_counter()
+        inventory = parse()
+        wall_time = time.perf_counter() - start
+        requests_count = sum(get_stub_stats(url).values())
+
+        tracemalloc.start()
+        parse()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            "instances": size,
+            "hosts": len(inventory.hosts),
+            "wall_time_s": round(wall_time, 3),
+            "requests": requests_count,
+            "peak_memory_mib": round(peak_memory / 1024 / 1024, 2),
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the fm_dss inventory plugin against a stub FM")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="Numbers of instances")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added by the stub to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Ratio of status requests failing with a 502")
+    parser.add_argument("--status-concurrency", type=int, default=10)
+    parser.add_argument("--options", type=json.loads, default={}, help="Additional plugin options, as a JSON object")
+    parser.add_argument("--collections-path", default=DEFAULT_COLLECTIONS_PATH)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Keep the plugin logs")
+    args = parser.parse_args()
+
+    from ansible.plugins.loader import init_plugin_loader
+    init_plugin_loader([args.collections_path])
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results.append(run_benchmark(size, args, workdir))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'instances':>10} {'hosts':>8} {'wall time (s)':>14} {'requests':>9} {'peak memory (MiB)':>18}")
+        for result in results:
+            print(f"{result['instances']:>10} {result['hosts']:>8} {result['wall_time_s']:>14} {result['requests']:>9} "
+                  f"{result['peak_memory_mib']:>18}")
+
+
+if __name__ == "__main__":
+    main()
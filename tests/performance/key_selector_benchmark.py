@@ -0,0 +1,102 @@
+"""Measures the selection of dotted key paths in DSS general settings, as done by dss_general_settings.
+
+The paths are selected with extract_keys and exclude_keys, which parse them on every call, and with a KeySelector
+compiled once. The settings document is generated with about the size of the general settings of a real DSS,
+its named lists being repeated to make it larger.
+
+The collection must be importable, for instance when it is installed in a collections path:
+
+    cd ~/.ansible/collections/ansible_collections/dataiku/dss
+    python tests/performance/key_selector_benchmark.py --list-sizes 10 100 1000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+DEFAULT_COLLECTIONS_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", ".."))
+
+SELECTED_PATHS = [
+    "ldapSettings.bindPassword", "ssoSettings.samlSPParams.keystorePassword", "ssoSettings.openIDParams.clientSecret",
+    "azureADSettings.credentialsClientSecret", "azureADSettings.credentialsCertificatePassword",
+    "containerSettings.executionConfigs", "sparkSettings.executionConfigs",
+]
+
+
+def generate_settings(list_size):
+    """A general settings document with the sections of a DSS one, and list_size elements in its named lists"""
+    settings = {
+        "ldapSettings": {"enabled": True, "url": "ldap://ldap.example.com", "bindDN": "cn=dss", "bindPassword": "secret",
+                         "userFilter": "(uid={USERNAME})", "groupProfiles": [{"group": f"group-{i}", "profile": "READER"}
+                                                                             for i in range(list_size)]},
+        "ssoSettings": {"enabled": False, "samlSPParams": {"keystorePassword": "secret", "entityId": "dss"},
+                        "openIDParams": {"clientId": "dss", "clientSecret": "secret", "scope": "openid"}},
+        "azureADSettings": {"enabled": False, "credentialsClientSecret": "secret",
+                            "credentialsCertificatePassword": "secret"},
+        "containerSettings": {"executionConfigs": [
+            {"name": f"config-{i}", "type": "KUBERNETES", "kubernetesNamespace": "dss", "cpuLimit": "2",
+             "properties": [{"key": f"key-{j}", "value": f"value-{j}"} for j in range(5)]}
+            for i in range(list_size)
+        ]},
+        "sparkSettings": {"executionConfigs": [
+            {"name": f"spark-{i}", "conf": [{"key": f"spark.conf.{j}", "value": str(j)} for j in range(20)]}
+            for i in range(list_size)
+        ]},
+        "globalVariables": {f"variable_{i}": f"value_{i}" for i in range(list_size)},
+    }
+    # The many small sections of a DSS general settings
+    for i in range(150):
+        settings[f"section{i}"] = {f"option{j}": j for j in range(10)}
+    return settings
+
+
+def run_benchmark(list_size, repeat):
+    from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
+        KeySelector,
+        build_template_from_fields,
+        exclude_keys,
+        extract_keys,
+    )
+
+    settings = generate_settings(list_size)
+    selector = KeySelector(SELECTED_PATHS)
+
+    def per_call():
+        extract_keys(settings, build_template_from_fields(SELECTED_PATHS, None))
+        exclude_keys(settings, SELECTED_PATHS)
+
+    def compiled():
+        selector.project(settings)
+
+    return {
+        "list_size": list_size,
+        "settings_kib": round(len(json.dumps(settings)) / 1024, 1),
+        "per_call_us": round(min(timeit.repeat(per_call, number=repeat, repeat=3)) / repeat * 1e6, 1),
+        "compiled_us": round(min(timeit.repeat(compiled, number=repeat, repeat=3)) / repeat * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the selection of key paths in DSS general settings")
+    parser.add_argument("--list-sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Numbers of elements in the named lists of the settings")
+    parser.add_argument("--repeat", type=int, default=1000, help="Selections timed per measure")
+    parser.add_argument("--collections-path", default=DEFAULT_COLLECTIONS_PATH)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.collections_path)
+    results = [run_benchmark(list_size, args.repeat) for list_size in args.list_sizes]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'list size':>10} {'settings (KiB)':>15} {'per call (us)':>14} {'compiled (us)':>14}")
+        for result in results:
+            print(f"{result['list_size']:>10} {result['settings_kib']:>15} {result['per_call_us']:>14} "
+                  f"{result['compiled_us']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import types
+from unittest.mock import MagicMock
+
+import pytest
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+
+from ansible_collections.dataiku.dss.plugins.plugin_utils import dss_action
+from ansible_collections.dataiku.dss.plugins.plugin_utils.dss_action import DssModuleActionBase
+
+
+def fake_dss_module():
+    def main():
+        module = AnsibleModule(argument_spec=dict(name=dict(type="str", required=True)), supports_check_mode=True)
+        if module.params["name"] == "broken":
+            module.fail_json(msg="broken group")
+        module.exit_json(changed=True, name=module.params["name"], api_key=os.environ.get("DATAIKU_ANSIBLE_DSS_API_KEY"))
+
+    return types.SimpleNamespace(main=main)
+
+
+def build_action(args, transport="local", become=False):
+    task = MagicMock(args=args, action="dataiku.dss.dss_group", async_val=0, check_mode=False, no_log=False, diff=False,
+                     environment=[{"DATAIKU_ANSIBLE_DSS_API_KEY": "secret"}])
+    connection = MagicMock(transport=transport, socket_path=None, become=MagicMock() if become else None)
+    connection._shell.tmpdir = None
+    connection._shell.get_option.return_value = "~/.ansible/tmp"
+    play_context = MagicMock(executable="/bin/sh", remote_addr="localhost")
+    loader = DataLoader()
+    return DssModuleActionBase(task, connection, play_context, loader, Templar(loader=loader), None)
+
+
+@pytest.fixture(autouse=True)
+def fake_module(monkeypatch):
+    monkeypatch.setattr(dss_action.importlib, "import_module", lambda name: fake_dss_module())
+
+
+def test_runs_in_process_with_task_environment():
+    result = build_action({"name": "datascienceguys"}).run(task_vars={})
+
+    assert result["changed"] is True
+    assert result["name"] == "datascienceguys"
+    assert result["api_key"] == "secret"
+    assert "DATAIKU_ANSIBLE_DSS_API_KEY" not in os.environ
+
+
+def test_module_failure_is_returned():
+    result = build_action({"name": "broken"}).run(task_vars={})
+
+    assert result["failed"] is True
+    assert result["msg"] == "broken group"
+
+
+@pytest.mark.parametrize("transport, become, task_vars", [
+    ("ssh", False, {}),
+    ("local", True, {}),
+    ("local", False, {"dataiku_dss_in_process": False}),
+])
+def test_falls_back_to_module_execution(transport, become, task_vars):
+    action = build_action({"name": "datascienceguys"}, transport, become)
+    action._execute_module = MagicMock(return_value={"changed": False})
+
+    assert action.run(task_vars=task_vars)["changed"] is False
+    action._execute_module.assert_called_once()
+
+
+def test_api_cache_directory_is_set_per_play(tmp_path):
+    action = build_action({"name": "datascienceguys"})
+    action._task.get_play.return_value = types.SimpleNamespace(_uuid="play-1")
+    action._execute_module = MagicMock(return_value={"changed": False})
+
+    action.run(task_vars={"dataiku_dss_in_process": False, "dataiku_dss_api_cache": True,
+                          "dataiku_dss_api_cache_dir": str(tmp_path), "dataiku_dss_api_cache_ttl": 60})
+
+    assert action._task.environment == [
+        {"DATAIKU_ANSIBLE_DSS_CACHE_DIR": str(tmp_path / "dataiku-dss-api-cache-play-1"),
+         "DATAIKU_ANSIBLE_DSS_CACHE_TTL": "60"},
+        {"DATAIKU_ANSIBLE_DSS_API_KEY": "secret"},
+    ]
+
+
+def test_perf_is_enabled_by_variable():
+    action = build_action({"name": "datascienceguys"})
+    action._execute_module = MagicMock(return_value={"changed": False})
+
+    action.run(task_vars={"dataiku_dss_in_process": False, "dataiku_dss_perf": True})
+
+    assert action._task.environment == [
+        {"DATAIKU_ANSIBLE_DSS_PERF": "true"},
+        {"DATAIKU_ANSIBLE_DSS_API_KEY": "secret"},
+    ]
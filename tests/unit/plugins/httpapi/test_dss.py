@@ -0,0 +1,117 @@
+import base64
+import io
+import json
+import types
+
+import pytest
+import requests
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+
+from ansible_collections.dataiku.dss.plugins.httpapi.dss import HttpApi
+from ansible_collections.dataiku.dss.plugins.module_utils import dataiku_utils
+from ansible_collections.dataiku.dss.plugins.module_utils.dss_httpapi import PersistentConnectionSession
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+    def getcode(self):
+        return self.status_code
+
+
+class FakeConnection(object):
+    """Stands for the ansible.netcommon.httpapi connection, with the error handling of the httpapi plugin"""
+
+    def __init__(self, responses):
+        self._auth = None
+        self.responses = responses
+        self.requests = []
+        self.httpapi = HttpApi(self)
+
+    def send(self, path, data, method="GET", headers=None):
+        self.requests.append((method, path, data, dict(headers, **(self._auth or {}))))
+        status_code, body = self.responses.pop(0)
+        if status_code >= 400:
+            response = self.httpapi.handle_httperror(HTTPError(path, status_code, "Error", {}, None))
+            response = FakeResponse(response.code, response.headers)
+        else:
+            response = FakeResponse(status_code, {"Content-Type": "application/json"})
+        return response, io.BytesIO(json.dumps(body).encode("UTF-8"))
+
+    def send_request(self, data, **kwargs):
+        # The persistent connection forwards the calls to the httpapi plugin
+        return self.httpapi.send_request(data, **kwargs)
+
+
+def test_login_uses_api_key_as_basic_auth_user():
+    connection = FakeConnection([(200, {})])
+    connection.httpapi.login(None, "secret-key")
+    connection.httpapi.send_request(None, path="/dip/publicapi/admin/users/")
+
+    method, path, data, headers = connection.requests[0]
+    assert headers["Authorization"] == "Basic " + base64.b64encode(b"secret-key:").decode("ascii")
+
+
+def test_session_routes_client_requests(monkeypatch):
+    connection = FakeConnection([(200, [{"login": "admin"}]), (404, {"errorType": "NotFound", "message": "No user"})])
+    monkeypatch.setattr(
+        "ansible_collections.dataiku.dss.plugins.module_utils.dss_httpapi.Connection", lambda socket_path: connection
+    )
+    session = PersistentConnectionSession("/tmp/socket")
+
+    response = session.request("GET", "http://127.0.0.1:80/dip/publicapi/admin/users/", params={"connected": "true"})
+    assert response.status_code == 200
+    assert response.json() == [{"login": "admin"}]
+    assert connection.requests[0][:3] == ("GET", "/dip/publicapi/admin/users/?connected=true", None)
+
+    # Errors are returned to the client, which raises them
+    response = session.request("PUT", "http://127.0.0.1:80/dip/publicapi/admin/users/bob", data=json.dumps({"login": "bob"}))
+    assert response.status_code == 404
+    assert response.json()["errorType"] == "NotFound"
+    method, path, data, headers = connection.requests[1]
+    assert (method, data, headers["Content-Type"]) == ("PUT", '{"login": "bob"}', "application/json")
+
+
+def test_dataikuapi_client_without_api_key(monkeypatch):
+    pytest.importorskip("dataikuapi")
+    from dataikuapi.dssclient import DSSClient
+
+    connection = FakeConnection([(200, [{"login": "admin"}])])
+    monkeypatch.setattr(
+        "ansible_collections.dataiku.dss.plugins.module_utils.dss_httpapi.Connection", lambda socket_path: connection
+    )
+    monkeypatch.setattr(dataiku_utils, "uses_builtin_client", lambda: False)
+    monkeypatch.setattr(dataiku_utils, "_clients", {})
+    monkeypatch.delenv("DATAIKU_ANSIBLE_DSS_API_KEY", raising=False)
+    module = types.SimpleNamespace(
+        params=dict(connect_to=None, host=None, port=None, api_key=None, node_type=None, data_dir=None, transport=None),
+        _socket_path="/tmp/socket",
+    )
+
+    # The API key is sent by the connection, see test_login_uses_api_key_as_basic_auth_user
+    client = dataiku_utils.get_client_from_parsed_args(module, ["design"])
+
+    assert isinstance(client, DSSClient)
+    assert client.list_users() == [{"login": "admin"}]
+    method, path, data, headers = connection.requests[0]
+    assert (method, path) == ("GET", "/dip/publicapi/admin/users/?includeSettings=False")
+    assert "Authorization" not in headers
+
+
+def test_session_encodes_params_like_requests(monkeypatch):
+    connection = FakeConnection([(200, {}), (200, {})])
+    monkeypatch.setattr(
+        "ansible_collections.dataiku.dss.plugins.module_utils.dss_httpapi.Connection", lambda socket_path: connection
+    )
+    session = PersistentConnectionSession("/tmp/socket")
+
+    params = {"packages": ["numpy", None, "pandas"], "versionToUpdate": None, "forceRebuildEnv": False}
+    session.request("POST", "http://127.0.0.1:80/dip/publicapi/admin/code-envs/PYTHON/env/packages", params=params)
+    session.request("GET", "http://127.0.0.1:80/dip/publicapi/admin/users/?connected=true", params={"offset": 10})
+
+    prepared = requests.Request("POST", "http://127.0.0.1:80/dip/publicapi/admin/code-envs/PYTHON/env/packages",
+                                params=params).prepare()
+    assert connection.requests[0][1] == prepared.path_url
+    assert connection.requests[1][1] == "/dip/publicapi/admin/users/?connected=true&offset=10"
@@ -0,0 +1,197 @@
+"""Local stub of the Fleet Manager public API used by the fm_dss inventory plugin.
+
+It serves /virtual-networks, /instance-settings-templates, /instances and /instances/{id}/status
+for any tenant, with synthetic instances. It also answers /dip/api/get-configuration like a DSS,
+and the private IP of the instances can point to the stub so that it is probed as their DSS. Latency and errors can be injected to reproduce slow or flaky FMs.
+The DSS can also answer with the HTML page of the nginx in front of a DSS that is down.
+
+It can be started in a thread by the tests, or as a standalone process:
+
+    python fm_stub_server.py --instances 10000 --latency 0.01 --port 8080
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NODE_TYPES = ["design", "automation", "deployer", "govern"]
+STATS_PATH = "/__stub__/stats"
+DSS_CONFIGURATION_PATH = "/dip/api/get-configuration"
+
+
+def build_instances(count, vnets_count):
+    instances = []
+    for index in range(count):
+        vnet_index = index % vnets_count
+        instances.append({
+            "id": f"instance-{index}",
+            "label": f"node-{index}",
+            "virtualNetworkId": f"vnet-{vnet_index}",
+            "virtualNetworkLabel": f"vnet{vnet_index}",
+            "instanceSettingsTemplateId": f"template-{index % 3 // 2}",
+            "instanceSettingsTemplateLabel": f"template{index % 3 // 2}",
+            "imageId": "image-0",
+            "dssNodeType": NODE_TYPES[index % len(NODE_TYPES)],
+            "fmTags": ["production"] if index % 2 == 0 else [],
+        })
+    return instances
+
+
+def build_templates():
+    # The instances of the second template run DSS on another port
+    return [
+        {"id": "template-0", "label": "template0", "setupActions": []},
+        {"id": "template-1", "label": "template1", "setupActions": [
+            {"type": "UPDATE_DSS_PORT", "enabled": True, "params": {"dssPort": 11000}},
+        ]},
+    ]
+
+
+def build_status(index, private_ip=None):
+    # One instance out of ten is stopped
+    return {
+        "hasPhysicalInstance": True,
+        "cloudMachineIsUp": index % 10 != 9,
+        "publicIP": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+        "privateIP": private_ip or f"192.168.{index // 256 % 256}.{index % 256}",
+        "publicDNS": f"node-{index}.public.example.com",
+        "privateDNS": f"node-{index}.internal",
+    }
+
+
+class FleetManagerStub(object):
+    def __init__(self, instances=10, vnets=2, latency=0.0, error_rate=0.0, error_endpoints=None, host="127.0.0.1", port=0,
+                 seed=0, api_keys=None, private_ip=None, dss_page_status=None):
+        self.vnets = [{"id": f"vnet-{index}", "label": f"vnet{index}"} for index in range(vnets)]
+        self.instances = build_instances(instances, vnets)
+        self.templates = build_templates()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_endpoints = error_endpoints
+        self.api_keys = api_keys
+        self.private_ip = private_ip
+        # Status of the HTML page answered instead of the DSS configuration, when set
+        self.dss_page_status = dss_page_status
+        self.random = random.Random(seed)
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._build_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def _record(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if self.error_endpoints is not None and endpoint not in self.error_endpoints:
+                return False
+            return self.random.random() < self.error_rate
+
+    def _build_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, code, body):
+                data = json.dumps(body).encode("UTF-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_page(self, code):
+                data = f"<html><body><h1>{code} {self.responses[code][0]}</h1></body></html>".encode("UTF-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == STATS_PATH:
+                    with stub.lock:
+                        return self._send_json(200, dict(stub.requests))
+                if self.path == DSS_CONFIGURATION_PATH:
+                    stub._record("dss-configuration")
+                    if stub.dss_page_status is not None:
+                        return self._send_page(stub.dss_page_status)
+                    return self._send_json(200, {"version": {"product_version": "13.0.0"}, "nodeType": "DESIGN"})
+
+                match = re.match(r"^/api/public/tenants/[^/]+/(virtual-networks|instance-settings-templates|instances)(?:/([^/]+)/status)?$", self.path)
+                if match is None:
+                    return self._send_json(404, {"message": f"Unknown path {self.path}"})
+                endpoint = "instances/{id}/status" if match.group(2) else match.group(1)
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+                injected_error = stub._record(endpoint)
+                if stub.api_keys is not None:
+                    authorization = self.headers.get("Authorization", "")
+                    credentials = base64.b64decode(authorization[6:]).decode("UTF-8") if authorization.startswith("Basic ") else ""
+                    if credentials.split(":", 1)[0] not in stub.api_keys:
+                        return self._send_json(401, {"message": "Unknown API key"})
+                if injected_error:
+                    return self._send_json(502, {"message": "Injected error"})
+
+                if endpoint == "virtual-networks":
+                    return self._send_json(200, stub.vnets)
+                if endpoint == "instance-settings-templates":
+                    return self._send_json(200, stub.templates)
+                if endpoint == "instances":
+                    return self._send_json(200, stub.instances)
+                index = int(match.group(2).rsplit("-", 1)[-1])
+                return self._send_json(200, build_status(index, stub.private_ip))
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request_count(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a stub of the Fleet Manager public API")
+    parser.add_argument("--instances", type=int, default=10)
+    parser.add_argument("--vnets", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Ratio of requests answered with a 502")
+    parser.add_argument("--error-endpoint", action="append", dest="error_endpoints",
+                        help="Only inject errors on this endpoint, ex: 'instances/{id}/status'. Can be repeated")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    stub = FleetManagerStub(
+        args.instances, args.vnets, args.latency, args.error_rate, args.error_endpoints, args.host, args.port
+    )
+    print(f"Serving {args.instances} instances on http://{args.host}:{stub.port}", flush=True)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
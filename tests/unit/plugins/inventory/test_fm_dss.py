@@ -0,0 +1,370 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+import yaml
+
+from ansible.errors import AnsibleParserError
+from ansible.inventory.data import InventoryData
+from ansible.inventory.helpers import get_group_vars
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import inventory_loader
+from ansible.template import Templar
+from ansible.utils.vars import combine_vars
+
+from ansible_collections.dataiku.dss.tests.unit.plugins.inventory.fm_stub_server import FleetManagerStub
+
+
+@pytest.fixture
+def fleet_manager():
+    stub = FleetManagerStub(instances=20, vnets=2).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def api_key_file(tmp_path):
+    path = tmp_path / "fm.json"
+    path.write_text(json.dumps({"id": "key", "secret": "secret"}))
+    return str(path)
+
+
+def fleet_manager_config(stub, api_key_file, **instances_config):
+    instances_config.setdefault("ssh", {"user": "centos"})
+    return {
+        "id": "fm",
+        "host": "127.0.0.1",
+        "port": stub.port,
+        "protocol": "http",
+        "instances": instances_config,
+        "api_key": {"file": api_key_file},
+    }
+
+
+def parse_inventory(tmp_path, fleet_managers, read_cache=False, **options):
+    config = {"plugin": "dataiku.dss.fm_dss", "dataiku_fleet_managers": fleet_managers, "request_retries": 0}
+    config.update(options)
+    path = tmp_path / "inventory.fm_dss.yml"
+    path.write_text(yaml.safe_dump(config))
+
+    inventory = InventoryData()
+    plugin = inventory_loader.get("dataiku.dss.fm_dss")
+    plugin.parse(inventory, DataLoader(), str(path), cache=read_cache)
+    # Like the inventory manager does once the inventory is parsed
+    plugin.update_cache_if_changed()
+    return inventory
+
+
+def cache_options(tmp_path, **options):
+    options.update(cache=True, cache_plugin="ansible.builtin.jsonfile", cache_connection=str(tmp_path / "cache"))
+    options.setdefault("cache_timeout", 600)
+    return options
+
+
+def expire_tenant_cache(tmp_path):
+    # The cache plugin expires the entries from the modification time of their file
+    for path in (tmp_path / "cache").iterdir():
+        if not path.name.endswith("_statuses"):
+            os.utime(path, (time.time() - 3600, time.time() - 3600))
+
+
+def read_tenant_source(stats_file):
+    tenant_stats, = json.loads(stats_file.read_text())["tenants"]
+    return tenant_stats["source"]
+
+
+def test_parse(tmp_path, fleet_manager, api_key_file):
+    inventory = parse_inventory(tmp_path, [fleet_manager_config(fleet_manager, api_key_file)], status_concurrency=4)
+
+    # Stopped instances are not added and the order of the listing is kept
+    expected_hosts = [f"fm-fm-main-node-{index}" for index in range(20) if index % 10 != 9]
+    assert list(inventory.hosts) == expected_hosts
+    assert sorted(inventory.groups["fm-fm-main"].child_groups, key=lambda group: group.name) == [
+        inventory.groups["fm-fm-main-vnet0"], inventory.groups["fm-fm-main-vnet1"]
+    ]
+    assert [host.name for host in inventory.groups["fm-fm-main-vnet1"].hosts] == [
+        f"fm-fm-main-node-{index}" for index in range(1, 20, 2) if index % 10 != 9
+    ]
+
+    host = inventory.hosts["fm-fm-main-node-3"]
+    assert host.vars["ansible_host"] == "10.0.0.3"
+    assert host.vars["ansible_user"] == "centos"
+    assert host.vars["dataiku"]["dss"]["node_type"] == "govern"
+    assert host.vars["dataiku"]["dss"]["logical_instance_id"] == "instance-3"
+    assert host.vars["dataiku"]["dss"]["port"] == "10000"
+    assert host.vars["dataiku"]["dss"]["datadir"] == "/data/dataiku/dss_data"
+    # The port of the instances of template1 is changed by a setup action of the template
+    assert inventory.hosts["fm-fm-main-node-2"].vars["dataiku"]["dss"]["port"] == "11000"
+    assert fleet_manager.requests == {
+        "virtual-networks": 1, "instance-settings-templates": 1, "instances": 1, "instances/{id}/status": 20
+    }
+
+
+def test_filters_skip_status_requests(tmp_path, fleet_manager, api_key_file):
+    config = fleet_manager_config(
+        fleet_manager, api_key_file, required_fm_tags=["production"], filters={"node_types": ["design"], "vnets": ["vnet0"]}
+    )
+    inventory = parse_inventory(tmp_path, [config])
+
+    assert list(inventory.hosts) == ["fm-fm-main-node-0", "fm-fm-main-node-4", "fm-fm-main-node-8",
+                                     "fm-fm-main-node-12", "fm-fm-main-node-16"]
+    assert fleet_manager.requests["instances/{id}/status"] == 5
+
+
+def test_failing_tenant_does_not_stop_others(tmp_path, fleet_manager, api_key_file):
+    broken = fleet_manager_config(fleet_manager, api_key_file)
+    broken.update(id="broken", port=1)
+    inventory = parse_inventory(tmp_path, [broken, fleet_manager_config(fleet_manager, api_key_file)])
+
+    assert "fm-broken-main" not in inventory.groups
+    assert len(inventory.groups["fm-fm-main"].get_hosts()) == 18
+
+    with pytest.raises(AnsibleParserError, match="1/2 tenants fetched"):
+        parse_inventory(tmp_path, [broken, fleet_manager_config(fleet_manager, api_key_file)], strict=True)
+
+
+def test_failing_statuses_are_skipped(tmp_path, api_key_file):
+    stub = FleetManagerStub(instances=50, error_rate=0.2, error_endpoints=["instances/{id}/status"]).start()
+    try:
+        inventory = parse_inventory(tmp_path, [fleet_manager_config(stub, api_key_file)])
+        assert 0 < len(inventory.hosts) < 45
+    finally:
+        stub.stop()
+
+
+def test_rejected_api_key_only_fails_its_fm(tmp_path, fleet_manager, api_key_file):
+    rejecting = FleetManagerStub(instances=5, api_keys=["other-key"]).start()
+    try:
+        broken = fleet_manager_config(rejecting, api_key_file)
+        broken["id"] = "broken"
+        inventory = parse_inventory(tmp_path, [broken, fleet_manager_config(fleet_manager, api_key_file)])
+
+        assert "fm-broken-main" not in inventory.groups
+        assert len(inventory.groups["fm-fm-main"].get_hosts()) == 18
+        # The key is checked once, and the tenants of the FM are not queried with it
+        assert rejecting.requests == {"virtual-networks": 1}
+    finally:
+        rejecting.stop()
+
+
+def test_api_key_checked_on_a_tenant_to_fetch(tmp_path, fleet_manager, api_key_file):
+    stats_file = tmp_path / "stats.json"
+    options = cache_options(tmp_path, stats_file=str(stats_file))
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+
+    # The cached tenant is not requested, the key is checked with the vnets of the other one, which are reused
+    config["tenant_ids"] = ["main", "other"]
+    fleet_manager.requests.clear()
+    inventory = parse_inventory(tmp_path, [config], read_cache=True, **options)
+
+    assert len(inventory.groups["fm-fm-other"].get_hosts()) == 18
+    assert fleet_manager.requests["virtual-networks"] == 1
+    tenants_stats = {tenant_stats["tenant_id"]: tenant_stats for tenant_stats in json.loads(stats_file.read_text())["tenants"]}
+    assert (tenants_stats["main"]["source"], tenants_stats["main"]["requests"]) == ("cache", {})
+    assert tenants_stats["other"]["requests"]["virtual-networks"]["count"] == 1
+
+
+def test_empty_tenant_ids(tmp_path, fleet_manager, api_key_file):
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    config["tenant_ids"] = []
+    with pytest.raises(AnsibleParserError, match="tenant_ids of FM fm must not be empty"):
+        parse_inventory(tmp_path, [config])
+
+
+def test_stats_file(tmp_path, fleet_manager, api_key_file):
+    stats_file = tmp_path / "stats.json"
+    config = fleet_manager_config(fleet_manager, api_key_file, filters={"vnets": ["vnet0"]})
+    parse_inventory(tmp_path, [config], stats_file=str(stats_file))
+
+    stats = json.loads(stats_file.read_text())
+    assert stats["parse_time_s"] > 0
+    tenant_stats, = stats["tenants"]
+    assert tenant_stats["source"] == "fetched"
+    assert {endpoint: endpoint_stats["count"] for endpoint, endpoint_stats in tenant_stats["requests"].items()} == fleet_manager.requests
+    assert tenant_stats["requests"]["instances"]["bytes"] > 0
+    assert (tenant_stats["instances_seen"], tenant_stats["instances_filtered"], tenant_stats["hosts_added"],
+            tenant_stats["instances_down"]) == (20, 10, 10, 0)
+
+
+def test_stream_instances(tmp_path, monkeypatch, fleet_manager, api_key_file):
+    config = fleet_manager_config(fleet_manager, api_key_file, filters={"excluded_node_types": ["deployer"]})
+    expected_inventory = parse_inventory(tmp_path, [config])
+
+    # Small chunks so that the instances are split between several chunks
+    monkeypatch.setattr(sys.modules[inventory_loader.get("dataiku.dss.fm_dss").__module__], "STREAM_CHUNK_SIZE", 7)
+    inventory = parse_inventory(tmp_path, [config], stream_instances=True)
+
+    assert list(inventory.hosts) == list(expected_inventory.hosts)
+    for name, host in inventory.hosts.items():
+        assert host.vars == expected_inventory.hosts[name].vars
+    assert fleet_manager.requests["instances/{id}/status"] == 2 * 15
+
+
+def test_compact_host_vars(tmp_path, fleet_manager, api_key_file):
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    expected_inventory = parse_inventory(tmp_path, [config])
+    inventory = parse_inventory(tmp_path, [config], compact_host_vars=True)
+
+    assert list(inventory.hosts) == list(expected_inventory.hosts)
+    for name, host in inventory.hosts.items():
+        assert sorted(host.vars) == ["ansible_host", "dataiku_dss_logical_instance_id", "dataiku_dss_node_id",
+                                     "inventory_dir", "inventory_file"]
+        variables = combine_vars(get_group_vars(host.get_groups()), host.get_vars())
+        templar = Templar(DataLoader(), variables=variables)
+        expected_host = expected_inventory.hosts[name]
+        assert templar.template(variables["dataiku"]) == expected_host.vars["dataiku"]
+        assert variables["ansible_user"] == expected_host.vars["ansible_user"]
+    assert inventory.groups["fm-fm-main-template-template1"].vars["dataiku_dss_port"] == "11000"
+
+
+def test_probe_dss(tmp_path, api_key_file):
+    stub = FleetManagerStub(instances=20, private_ip="127.0.0.1").start()
+    try:
+        # The stub answers as the DSS of the instances of template0, nothing listens on the port of template1
+        config = fleet_manager_config(stub, api_key_file, access_type="private_ip", dss_port=stub.port)
+        inventory = parse_inventory(tmp_path, [config], probe_dss=True, probe_timeout=1)
+
+        host = inventory.hosts["fm-fm-main-node-0"]
+        assert host.vars["dataiku_dss_reachable"] is True
+        assert host.vars["dataiku_dss_version"] == "13.0.0"
+        assert host.vars["dataiku_dss_probed_node_type"] == "DESIGN"
+        assert inventory.hosts["fm-fm-main-node-2"].vars["dataiku_dss_reachable"] is False
+        assert [host.name for host in inventory.groups["fm-fm-main-unreachable"].hosts] == [
+            f"fm-fm-main-node-{index}" for index in range(20) if index % 3 == 2 and index % 10 != 9
+        ]
+        assert stub.requests["dss-configuration"] == 18 - len(inventory.groups["fm-fm-main-unreachable"].hosts)
+    finally:
+        stub.stop()
+
+
+@pytest.mark.parametrize("page_status", [502, 200])
+def test_probe_dss_error_page(tmp_path, api_key_file, page_status):
+    stub = FleetManagerStub(instances=3, private_ip="127.0.0.1", dss_page_status=page_status).start()
+    try:
+        config = fleet_manager_config(stub, api_key_file, access_type="private_ip", dss_port=stub.port)
+        stats_file = tmp_path / "stats.json"
+        inventory = parse_inventory(tmp_path, [config], probe_dss=True, probe_timeout=1, stats_file=str(stats_file))
+
+        # Only node-2 has a template on another port, nothing listens on it
+        assert stub.requests["dss-configuration"] == 2
+        for name in ["fm-fm-main-node-0", "fm-fm-main-node-1"]:
+            assert inventory.hosts[name].vars["dataiku_dss_reachable"] is False
+            assert "dataiku_dss_version" not in inventory.hosts[name].vars
+        assert len(inventory.groups["fm-fm-main-unreachable"].hosts) == 3
+        tenant_stats, = json.loads(stats_file.read_text())["tenants"]
+        assert tenant_stats["requests"]["dss-probe"]["failed"] == 3
+    finally:
+        stub.stop()
+
+
+@pytest.mark.parametrize("control_persist, ssh_args", [
+    ("", "-C"),
+    ("10m", "-C -o ControlMaster=auto -o ControlPersist=10m"),
+    ("60s", None),
+])
+def test_ssh_tuning(tmp_path, fleet_manager, api_key_file, monkeypatch, control_persist, ssh_args):
+    monkeypatch.setenv("ANSIBLE_SSH_COMMON_ARGS", "-o ProxyJump=bastion")
+    monkeypatch.setenv("ANSIBLE_SSH_EXTRA_ARGS", "-o ServerAliveInterval=30")
+    config = fleet_manager_config(fleet_manager, api_key_file, ssh={
+        "user": "centos",
+        "tuning": {"address_family": "inet"},
+        "vnets_tuning": {"vnet1": {"control_persist": control_persist, "pipelining": False}},
+    })
+    inventory = parse_inventory(tmp_path, [config])
+
+    # The configured ssh args already hold the default multiplexing, and the common args are left to the configuration
+    assert inventory.groups["fm-fm-main-vnet0"].vars == {
+        "ansible_ssh_extra_args": "-o ServerAliveInterval=30 -o AddressFamily=inet",
+        "ansible_pipelining": True,
+    }
+    expected_vnet1_vars = {
+        "ansible_ssh_extra_args": "-o ServerAliveInterval=30 -o AddressFamily=inet",
+        "ansible_pipelining": False,
+    }
+    if ssh_args is not None:
+        expected_vnet1_vars["ansible_ssh_args"] = ssh_args
+    assert inventory.groups["fm-fm-main-vnet1"].vars == expected_vnet1_vars
+
+
+def test_ssh_tuning_replaces_configured_multiplexing(tmp_path, fleet_manager, api_key_file, monkeypatch):
+    monkeypatch.setenv("ANSIBLE_SSH_ARGS", "-C -oControlMaster=auto -o 'ControlPersist 30m' -o ForwardAgent=yes")
+    config = fleet_manager_config(fleet_manager, api_key_file, ssh={"user": "centos", "tuning": {"control_persist": "60s"}})
+    inventory = parse_inventory(tmp_path, [config])
+
+    assert inventory.groups["fm-fm-main-vnet0"].vars["ansible_ssh_args"] == (
+        "-C -o ForwardAgent=yes -o ControlMaster=auto -o ControlPersist=60s"
+    )
+
+
+def test_incremental_refresh_after_expiry(tmp_path, fleet_manager, api_key_file):
+    stats_file = tmp_path / "stats.json"
+    options = cache_options(tmp_path, incremental_refresh=True, stats_file=str(stats_file))
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+    assert fleet_manager.requests["instances/{id}/status"] == 20
+
+    expire_tenant_cache(tmp_path)
+    fleet_manager.instances[3]["label"] = "renamed-node-3"
+    fleet_manager.requests.clear()
+    inventory = parse_inventory(tmp_path, [config], read_cache=True, **options)
+
+    # The listing is fetched again, but only the status of the changed instance
+    assert fleet_manager.requests == {
+        "virtual-networks": 1, "instance-settings-templates": 1, "instances": 1, "instances/{id}/status": 1
+    }
+    assert read_tenant_source(stats_file) == "incremental"
+    assert "fm-fm-main-renamed-node-3" in inventory.hosts
+    assert len(inventory.hosts) == 18
+
+
+def test_cache_hit_and_refresh(tmp_path, fleet_manager, api_key_file):
+    stats_file = tmp_path / "stats.json"
+    options = cache_options(tmp_path, stats_file=str(stats_file))
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+    assert read_tenant_source(stats_file) == "fetched"
+
+    fleet_manager.requests.clear()
+    inventory = parse_inventory(tmp_path, [config], read_cache=True, **options)
+    assert fleet_manager.requests == {}
+    assert read_tenant_source(stats_file) == "cache"
+    assert len(inventory.hosts) == 18
+
+    # An inventory refresh does not read the cache
+    parse_inventory(tmp_path, [config], read_cache=False, **options)
+    assert fleet_manager.requests["instances"] == 1
+    assert read_tenant_source(stats_file) == "fetched"
+
+
+def test_cache_expiry(tmp_path, fleet_manager, api_key_file):
+    stats_file = tmp_path / "stats.json"
+    options = cache_options(tmp_path, stats_file=str(stats_file))
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+
+    expire_tenant_cache(tmp_path)
+    fleet_manager.requests.clear()
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+    assert fleet_manager.requests["instances/{id}/status"] == 20
+    assert read_tenant_source(stats_file) == "fetched"
+
+
+def test_cache_without_timeout(tmp_path, fleet_manager, api_key_file):
+    stats_file = tmp_path / "stats.json"
+    options = cache_options(tmp_path, stats_file=str(stats_file), cache_timeout=0)
+    config = fleet_manager_config(fleet_manager, api_key_file)
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+
+    # Neither the cache plugin nor the plugin expire the data, however old it is
+    cache_file, = (tmp_path / "cache").iterdir()
+    tenant_data = json.loads(cache_file.read_text())
+    tenant_data["fetched_at"] = 0
+    cache_file.write_text(json.dumps(tenant_data))
+    expire_tenant_cache(tmp_path)
+    fleet_manager.requests.clear()
+    parse_inventory(tmp_path, [config], read_cache=True, **options)
+    assert fleet_manager.requests == {}
+    assert read_tenant_source(stats_file) == "cache"
@@ -1,14 +1,27 @@
 import os
+import sys
+import time
+import types
+
 import pytest
 
+from ansible.module_utils.common.collections import Mapping
 from ansible_collections.dataiku.dss.plugins.module_utils.dataiku_utils import (
     MakeNamespace,
     is_version_more_recent,
     discover_install_dir_python,
+    add_dataikuapi_to_path,
+    cached_api_read,
+    invalidate_api_cache,
+    diff_structures,
+    build_diff_output,
+    SettingsOverlay,
     update,
     extract_keys,
     exclude_keys,
+    KeySelector,
     smart_update_named_lists,
+    smart_update_named_lists_at_paths,
     build_template_from_fields
 )
 
@@ -57,6 +70,118 @@ fi
     assert computed_install_dir_2 is None
 
 
+def test_discover_install_dir_python_is_memoized(tmp_path):
+    (tmp_path / "bin").mkdir()
+    env_file = tmp_path / "bin" / "env-default.sh"
+    env_file.write_text('export DKUINSTALLDIR="/opt/dataiku-dss-13"\n')
+
+    assert discover_install_dir_python(str(tmp_path)) == "/opt/dataiku-dss-13/python"
+
+    # While its modification time is the same, the file is not read again
+    env_stat = env_file.stat()
+    env_file.write_text('export DKUINSTALLDIR="/opt/dataiku-dss-14"\n')
+    os.utime(env_file, ns=(env_stat.st_atime_ns, env_stat.st_mtime_ns))
+    assert discover_install_dir_python(str(tmp_path)) == "/opt/dataiku-dss-13/python"
+
+    # The file is read again once it is modified
+    os.utime(env_file, ns=(time.time_ns(), env_stat.st_mtime_ns + 10 ** 9))
+    assert discover_install_dir_python(str(tmp_path)) == "/opt/dataiku-dss-14/python"
+
+
+@pytest.fixture
+def fake_dataikuapi(tmp_path, monkeypatch):
+    # A dataikuapi package whose __init__.py imports its clients, like the real one
+    install_dir = tmp_path / "install"
+    package_dir = install_dir / "python" / "dataikuapi"
+    package_dir.mkdir(parents=True)
+    (package_dir / "__init__.py").write_text("from .dssclient import DSSClient\n")
+    (package_dir / "utils.py").write_text("class DataikuException(Exception):\n    pass\n")
+    (package_dir / "dssclient.py").write_text("class DSSClient(object):\n    pass\n")
+    data_dir = tmp_path / "data"
+    (data_dir / "bin").mkdir(parents=True)
+    (data_dir / "bin" / "env-default.sh").write_text(f'export DKUINSTALLDIR="{install_dir}"\n')
+
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    previous_modules = {name: module for name, module in sys.modules.items() if name.split(".")[0] == "dataikuapi"}
+    for name in previous_modules:
+        del sys.modules[name]
+    yield str(data_dir)
+    for name in [name for name in sys.modules if name.split(".")[0] == "dataikuapi"]:
+        del sys.modules[name]
+    sys.modules.update(previous_modules)
+
+
+def test_bootstrap_imports_dataikuapi_lazily(fake_dataikuapi):
+    module = types.SimpleNamespace(params=dict(data_dir=fake_dataikuapi, connect_to=None), _socket_path=None)
+
+    add_dataikuapi_to_path(module)
+    add_dataikuapi_to_path(module)
+    from dataikuapi.utils import DataikuException
+
+    # The package __init__.py was not run, and the install dir is only added once to the path
+    assert issubclass(DataikuException, Exception)
+    assert "dataikuapi.dssclient" not in sys.modules
+    assert sum(1 for path in sys.path if path.endswith("install/python")) == 1
+
+    import dataikuapi
+    assert dataikuapi.DSSClient.__name__ == "DSSClient"
+
+
+def test_cached_api_read(tmp_path, monkeypatch):
+    module = types.SimpleNamespace(_socket_path=None)
+    client = types.SimpleNamespace(host="http://dss:10000")
+    other_client = types.SimpleNamespace(host="http://other-dss:10000")
+    reads = []
+
+    def list_plugins():
+        reads.append("/plugins/")
+        return [{"id": "geo"}]
+
+    # Disabled unless a cache directory is set
+    assert cached_api_read(module, client, "plugins", "/plugins/", list_plugins) == [{"id": "geo"}]
+    assert len(reads) == 1
+
+    monkeypatch.setenv("DATAIKU_ANSIBLE_DSS_CACHE_DIR", str(tmp_path))
+    for attempt in range(3):
+        assert cached_api_read(module, client, "plugins", "/plugins/", list_plugins) == [{"id": "geo"}], attempt
+    assert len(reads) == 2
+    # Cached by DSS
+    cached_api_read(module, other_client, "plugins", "/plugins/", list_plugins)
+    assert len(reads) == 3
+
+    # A write on another object class keeps the cache, one on plugins drops it
+    invalidate_api_cache(module, client, "code-envs")
+    cached_api_read(module, client, "plugins", "/plugins/", list_plugins)
+    assert len(reads) == 3
+    invalidate_api_cache(module, client, "plugins")
+    cached_api_read(module, client, "plugins", "/plugins/", list_plugins)
+    assert len(reads) == 4
+
+    # Expired responses are read again
+    monkeypatch.setenv("DATAIKU_ANSIBLE_DSS_CACHE_TTL", "0")
+    cached_api_read(module, client, "plugins", "/plugins/", list_plugins)
+    assert len(reads) == 5
+
+
+def test_stale_api_caches_are_purged(tmp_path, monkeypatch):
+    module = types.SimpleNamespace(_socket_path=None)
+    client = types.SimpleNamespace(host="http://dss:10000")
+    for name in ["dataiku-dss-api-cache-old", "dataiku-dss-api-cache-recent", "other-old"]:
+        (tmp_path / name / "plugins").mkdir(parents=True)
+        (tmp_path / name / "plugins" / "response.json").write_text("[]")
+    for path in [tmp_path / "dataiku-dss-api-cache-old", tmp_path / "other-old"]:
+        for cached in [path, path / "plugins", path / "plugins" / "response.json"]:
+            os.utime(cached, (time.time() - 3600, time.time() - 3600))
+
+    # The first response cached by a play removes the expired directories of the previous plays
+    monkeypatch.setenv("DATAIKU_ANSIBLE_DSS_CACHE_DIR", str(tmp_path / "dataiku-dss-api-cache-new"))
+    cached_api_read(module, client, "plugins", "/plugins/", lambda: [])
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "dataiku-dss-api-cache-new", "dataiku-dss-api-cache-recent", "other-old"
+    ]
+
+
 def test_update():
     input_dict = dict(data_dir="/data/dataiku/dss", nested=dict(host="localhost", port=10000, api_key="thisissecret"))
     update_keys = dict(nested=dict(port=20000))
@@ -86,11 +211,127 @@ def test_extract_keys(test_input, expected):
      dict(data_dir="/data/dataiku/dss", host=None, port=None, api_key="thisissecret")),
     ((dict(data_dir="/data/dataiku/dss", port=10000, nested=dict(port=10000, host="localhost")), ["port", "nested.port"]),
      dict(data_dir="/data/dataiku/dss", port=None, nested=dict(port=None, host="localhost"))),
+    ((dict(first=dict(port=10000, host="localhost"), second=dict(port=10000, host="localhost")), ["first.port", "second.host"]),
+     dict(first=dict(port=None, host="localhost"), second=dict(port=10000, host=None))),
 ])
 def test_exclude_keys(test_input, expected):
     assert exclude_keys(*test_input) == expected
 
 
+@pytest.mark.parametrize("before, after, expected", [
+    (dict(host="localhost", port=10000), dict(host="localhost", port=10000), []),
+    (dict(host="localhost", port=10000), dict(host="dss", api_key="secret"), [
+        dict(op="replace", path="/host", value="dss"),
+        dict(op="remove", path="/port"),
+        dict(op="add", path="/api_key", value="secret"),
+    ]),
+    (dict(nested=dict(groups=["a", "b", "c"])), dict(nested=dict(groups=["a", "d"])), [
+        dict(op="replace", path="/nested/groups/1", value="d"),
+        dict(op="remove", path="/nested/groups/2"),
+    ]),
+    (dict(groups=["a"]), dict(groups=["a", "b", "c"]), [
+        dict(op="add", path="/groups/1", value="b"),
+        dict(op="add", path="/groups/2", value="c"),
+    ]),
+    (dict(params={"a/b": 1, "c~d": dict(x=1)}), dict(params={"a/b": 2, "c~d": "x"}), [
+        dict(op="replace", path="/params/a~1b", value=2),
+        dict(op="replace", path="/params/c~0d", value="x"),
+    ]),
+    ([1, 2], dict(a=1), [dict(op="replace", path="", value=dict(a=1))]),
+])
+def test_diff_structures(before, after, expected):
+    assert diff_structures(before, after) == expected
+
+
+def test_build_diff_output():
+    before = dict(ldapSettings=dict(enabled=False, groups=["a", "b"]), maxRunningActivities=5)
+    after = dict(ldapSettings=dict(enabled=True, groups=["a"]), maxRunningActivities=5, sessionTimeout=3600)
+
+    assert build_diff_output(before, diff_structures(before, after)) == {
+        "before": {"/ldapSettings/enabled": False, "/ldapSettings/groups/1": "b"},
+        "after": {"/ldapSettings/enabled": True, "/sessionTimeout": 3600},
+    }
+
+
+def test_settings_overlay():
+    base = dict(name="conn", params=dict(host="localhost", port=5432, properties=[dict(name="a")]), usableBy="ALL")
+
+    overlay = SettingsOverlay(base)
+    update(overlay, dict(params=dict(port=5433, db="dss"), description="PostgreSQL"))
+    overlay["params"]["properties"].append(dict(name="b"))
+    del overlay["usableBy"]
+
+    # The base is left unchanged
+    assert base == dict(name="conn", params=dict(host="localhost", port=5432, properties=[dict(name="a")]), usableBy="ALL")
+    assert overlay == dict(name="conn", params=dict(host="localhost", port=5433, properties=[dict(name="a"), dict(name="b")], db="dss"),
+                           description="PostgreSQL")
+    assert list(overlay) == ["name", "params", "description"] and len(overlay) == 3
+    assert "usableBy" not in overlay and "description" in overlay
+    with pytest.raises(KeyError):
+        overlay["usableBy"]
+
+    materialized = overlay.materialize()
+    assert type(materialized) is dict and type(materialized["params"]) is dict
+    assert materialized == overlay
+    assert diff_structures(base, overlay) == [
+        dict(op="remove", path="/usableBy"),
+        dict(op="replace", path="/params/port", value=5433),
+        dict(op="add", path="/params/db", value="dss"),
+        dict(op="add", path="/params/properties/1", value=dict(name="b")),
+        dict(op="add", path="/description", value="PostgreSQL"),
+    ]
+
+
+def test_settings_overlay_lists_elements_changed_in_place():
+    base = dict(executionConfigs=[dict(name="small", cpu=1)])
+
+    overlay = SettingsOverlay(base)
+    overlay["executionConfigs"][0]["cpu"] = 2
+
+    assert base == dict(executionConfigs=[dict(name="small", cpu=1)])
+    assert diff_structures(base, overlay) == [dict(op="replace", path="/executionConfigs/0/cpu", value=2)]
+
+
+class ReadRecordingMapping(Mapping):
+    """A read-only mapping adding its name to reads whenever it is read"""
+
+    def __init__(self, name, values, reads):
+        self.name = name
+        self._values = values
+        self._reads = reads
+
+    def __getitem__(self, key):
+        self._reads.add(self.name)
+        return self._values[key]
+
+    def __iter__(self):
+        self._reads.add(self.name)
+        return iter(self._values)
+
+    def __len__(self):
+        self._reads.add(self.name)
+        return len(self._values)
+
+
+def test_settings_overlay_only_diffs_its_changes():
+    reads = set()
+    base = ReadRecordingMapping("base", {
+        f"execConfig{index}": ReadRecordingMapping(
+            f"execConfig{index}", dict(name=f"config-{index}", cpu=1, properties=list(range(100))), reads
+        )
+        for index in range(100)
+    }, reads)
+    overlay = SettingsOverlay(base)
+    overlay["execConfig5"]["cpu"] = 2
+
+    changes = diff_structures(base, overlay)
+
+    assert changes == [dict(op="replace", path="/execConfig5/cpu", value=2)]
+    # The settings left untouched are never read
+    assert reads == {"base", "execConfig5"}
+    assert diff_structures(base, overlay.materialize()) == changes
+
+
 def test_smart_update_named_lists():
     named_list = [
         dict(name="first", phone="0102030405", address="somewhere"),
@@ -116,6 +357,92 @@ def test_smart_update_named_lists():
     assert result == expected
 
 
+def test_smart_update_named_lists_key_and_copies():
+    named_list = [dict(id="a", value=1), dict(id="b", value=2)]
+    update_named_list = [dict(id="b", value=3), dict(id="c", value=4)]
+
+    result = smart_update_named_lists(named_list, update_named_list, key="id")
+
+    assert result == [dict(id="a", value=1), dict(id="b", value=3), dict(id="c", value=4)]
+    # The current list is not modified, and only the updated elements are copied
+    assert named_list == [dict(id="a", value=1), dict(id="b", value=2)]
+    assert result[0] is named_list[0]
+
+
+class KeyLookupCountingDict(dict):
+    """A dict counting the lookups of its "name" key in lookups"""
+
+    def __init__(self, lookups, *args, **kwargs):
+        super(KeyLookupCountingDict, self).__init__(*args, **kwargs)
+        self._lookups = lookups
+
+    def __getitem__(self, key):
+        if key == "name":
+            self._lookups.append(key)
+        return super(KeyLookupCountingDict, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        if key == "name":
+            self._lookups.append(key)
+        return super(KeyLookupCountingDict, self).get(key, default)
+
+
+def test_smart_update_named_lists_is_linear():
+    lookups = []
+    named_list = [KeyLookupCountingDict(lookups, name=f"config-{index}", cpu=1) for index in range(2000)]
+    update_named_list = [KeyLookupCountingDict(lookups, name=f"config-{index}", cpu=2) for index in range(0, 4000, 2)]
+
+    result = smart_update_named_lists(named_list, update_named_list)
+
+    assert len(result) == 3000
+    assert result[2] == dict(name="config-2", cpu=2) and result[3] is named_list[3]
+    # A scan of the current list per update would look the names up millions of times
+    assert len(lookups) <= 2 * (len(named_list) + len(update_named_list))
+
+
+def test_smart_update_named_lists_at_paths():
+    current = dict(
+        containerSettings=dict(executionConfigs=[dict(name="small", cpu=1)], defaultExecutionConfig="small"),
+        sparkSettings=dict(executionConfigs=[dict(name="default", conf=[])]),
+    )
+    updates = dict(containerSettings=dict(executionConfigs=[dict(name="small", cpu=2), dict(name="large", cpu=8)]))
+
+    result = smart_update_named_lists_at_paths(current, updates, {
+        "containerSettings.executionConfigs": "name",
+        "sparkSettings.executionConfigs": "name",
+        "sparkSettings.profiles": "id",
+        "hadoopSettings.profiles": "id",
+    })
+
+    # The lists missing from both documents are left out
+    assert result == dict(
+        containerSettings=dict(executionConfigs=[dict(name="small", cpu=2), dict(name="large", cpu=8)]),
+        sparkSettings=dict(executionConfigs=[dict(name="default", conf=[])]),
+    )
+    assert current["containerSettings"]["executionConfigs"] == [dict(name="small", cpu=1)]
+
+
+def test_smart_update_named_lists_at_paths_with_unset_sections():
+    current = dict(containerSettings=None)
+    keys_by_path = {"containerSettings.executionConfigs": "name", "sparkSettings.executionConfigs": "name"}
+
+    assert smart_update_named_lists_at_paths(current, {}, keys_by_path) == {}
+    updates = dict(containerSettings=dict(executionConfigs=[dict(name="small", cpu=2)]), sparkSettings=None)
+    assert smart_update_named_lists_at_paths(current, updates, keys_by_path) == dict(
+        containerSettings=dict(executionConfigs=[dict(name="small", cpu=2)]),
+    )
+
+
+def test_smart_update_named_lists_without_key():
+    named_list = [dict(name="small", cpu=1), dict(cpu=2), dict(name=None, cpu=3)]
+    update_named_list = [dict(cpu=4), dict(name="small", cpu=5), dict(name=None, cpu=6)]
+
+    # The elements without key are not merged into each other
+    assert smart_update_named_lists(named_list, update_named_list) == [
+        dict(name="small", cpu=5), dict(cpu=2), dict(name=None, cpu=3), dict(cpu=4), dict(name=None, cpu=6)
+    ]
+
+
 def test_build_template_from_fields():
     input_fields = ["dataiku.dss.general_settings.container_exec.config", "dss.general_settings.config", "config"]
     default_value = None
@@ -129,3 +456,25 @@ def test_build_template_from_fields():
     }
 
     assert template == expected_template
+
+
+def test_key_selector():
+    settings = dict(
+        ldapSettings=dict(enabled=True, bindPassword="secret"),
+        ssoSettings=dict(enabled=False, samlSPParams=dict(keystorePassword="secret", entityId="dss")),
+        maxRunningActivities=5,
+    )
+    paths = ["ldapSettings.bindPassword", "ssoSettings.samlSPParams.keystorePassword", "azureADSettings.secret"]
+    selector = KeySelector(paths)
+
+    assert selector.extract(settings) == extract_keys(settings, build_template_from_fields(paths, None))
+    assert selector.exclude(settings) == exclude_keys(settings, paths)
+    assert selector.project(settings) == (selector.extract(settings), selector.exclude(settings))
+    assert selector.exclude(settings) == dict(
+        ldapSettings=dict(enabled=True, bindPassword=None),
+        ssoSettings=dict(enabled=False, samlSPParams=dict(keystorePassword=None, entityId="dss")),
+        maxRunningActivities=5,
+    )
+    # The input is never modified, and the values out of the paths are not copied
+    assert settings["ldapSettings"]["bindPassword"] == "secret"
+    assert selector.exclude(settings)["ssoSettings"] is not settings["ssoSettings"]
@@ -0,0 +1,195 @@
+import json
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ansible_collections.dataiku.dss.plugins.module_utils import dataiku_utils
+from ansible_collections.dataiku.dss.plugins.module_utils.dss_rest_client import (
+    DataikuException,
+    DSSRestClient,
+    configure_session,
+)
+
+
+class StubDSSHandler(BaseHTTPRequestHandler):
+    """Serves the users and general settings of an in-memory DSS"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        content = json.dumps(body).encode("UTF-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self):
+        dss = self.server.dss
+        dss["connections"].add(self.client_address)
+        dss["requests"].append((self.command, self.path, self.headers.get("Authorization")))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        path = self.path.split("?")[0][len("/dip/publicapi"):]
+
+        if path == "/admin/general-settings":
+            if dss["unavailable"] > 0:
+                dss["unavailable"] -= 1
+                return self._reply(503, {"message": "DSS is restarting"})
+            if self.command == "PUT":
+                dss["general_settings"] = body
+            return self._reply(200, dss["general_settings"] if self.command == "GET" else None)
+        if path == "/admin/users/" and self.command == "POST":
+            dss["users"][body["login"]] = body
+            return self._reply(200, {})
+        if path.startswith("/admin/users/"):
+            login = path[len("/admin/users/"):]
+            if login not in dss["users"]:
+                return self._reply(404, {
+                    "errorType": "com.dataiku.dip.server.controllers.NotFoundException",
+                    "message": f"User {login} not found",
+                })
+            if self.command == "DELETE":
+                del dss["users"][login]
+                return self._reply(204)
+            return self._reply(200, dss["users"][login])
+        if path == "/plugins/actions/installFromStore":
+            return self._reply(200, {"jobId": "job-1", "hasResult": False})
+        if path == "/futures/job-1":
+            return self._reply(200, {"jobId": "job-1", "hasResult": True, "result": {"pluginId": "geo"}})
+        self._reply(500, {"message": "Unexpected call"})
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+@pytest.fixture
+def stub_dss():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDSSHandler)
+    server.dss = dict(users={}, general_settings={"ldapSettings": {"enabled": False}}, requests=[], connections=set(),
+                      unavailable=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", server.dss
+    server.shutdown()
+    server.server_close()
+
+
+def test_user_lifecycle(stub_dss):
+    url, dss = stub_dss
+    client = DSSRestClient(url, api_key="secret")
+
+    with pytest.raises(DataikuException) as error:
+        client.get_user("alice").get_settings()
+    # The modules detect missing objects from the message, which must be the one of dataikuapi
+    assert str(error.value) == "com.dataiku.dip.server.controllers.NotFoundException: User alice not found"
+
+    client.create_user("alice", "password", display_name="Alice", groups=["readers"])
+    settings = client.get_user("alice").get_settings()
+    assert settings.get_raw()["displayName"] == "Alice"
+    assert settings.get_raw()["userProfile"] == "DATA_SCIENTIST"
+
+    client.get_user("alice").delete()
+    assert "alice" not in dss["users"]
+    assert dss["requests"][-1][1] == "/dip/publicapi/admin/users/alice?allowSelfDeletion=False"
+    # The API key is the user of a basic authentication, and all the calls share one HTTP connection
+    assert {request[2] for request in dss["requests"]} == {"Basic c2VjcmV0Og=="}
+    assert len(dss["connections"]) == 1
+
+
+def test_general_settings_and_futures(stub_dss, monkeypatch):
+    url, dss = stub_dss
+    monkeypatch.setattr("ansible_collections.dataiku.dss.plugins.module_utils.dss_rest_client.FUTURE_POLL_MIN_DELAY", 0)
+    client = DSSRestClient(url, api_key="secret")
+
+    general_settings = client.get_general_settings()
+    general_settings.settings["ldapSettings"]["enabled"] = True
+    general_settings.save()
+    assert dss["general_settings"] == {"ldapSettings": {"enabled": True}}
+
+    future = client.install_plugin_from_store("geo")
+    assert future.job_id == "job-1"
+    assert future.wait_for_result() == {"pluginId": "geo"}
+
+
+def test_builtin_client_is_used_without_dataikuapi(stub_dss, monkeypatch):
+    url, dss = stub_dss
+    monkeypatch.setattr(dataiku_utils, "uses_builtin_client", lambda: True)
+    monkeypatch.setattr(dataiku_utils, "_clients", {})
+    port = url.rsplit(":", 1)[-1]
+    module = types.SimpleNamespace(
+        params=dict(connect_to=dict(transport=dict(retries=5)), host="127.0.0.1", port=port, api_key="secret",
+                    node_type="govern", data_dir=None, transport=dict(scheme="http", connect_timeout=2)),
+        _socket_path=None,
+    )
+
+    client = dataiku_utils.get_client_from_parsed_args(module, ["design", "govern"])
+
+    assert isinstance(client, DSSRestClient)
+    assert dataiku_utils.get_dataiku_exception_class() is DataikuException
+    assert client.get_general_settings().get_raw() == {"ldapSettings": {"enabled": False}}
+    adapter = client._session.get_adapter(url)
+    assert adapter.timeout == (2, None)
+    assert adapter.max_retries.total == 5
+
+
+def test_transport_retries(stub_dss):
+    url, dss = stub_dss
+    client = DSSRestClient(url, api_key="secret")
+    configure_session(client._session, retries=2, retry_backoff=0)
+
+    dss["unavailable"] = 2
+    assert client.get_general_settings().get_raw() == {"ldapSettings": {"enabled": False}}
+    assert len(dss["requests"]) == 3
+
+    # Once the retries are exhausted, the last error is the one of the DSS
+    dss["unavailable"] = 3
+    with pytest.raises(DataikuException) as error:
+        client.get_general_settings()
+    assert str(error.value) == "Unknown error: DSS is restarting"
+    assert len(dss["connections"]) == 1
+
+
+def test_api_calls_are_recorded_by_phase(stub_dss, monkeypatch):
+    url, dss = stub_dss
+    monkeypatch.setattr(dataiku_utils, "uses_builtin_client", lambda: True)
+    monkeypatch.setattr(dataiku_utils, "_clients", {})
+    results = []
+    module = types.SimpleNamespace(
+        params=dict(connect_to=None, host="127.0.0.1", port=url.rsplit(":", 1)[-1], api_key="secret",
+                    node_type="design", data_dir=None, transport=None),
+        _socket_path=None,
+        exit_json=lambda **kwargs: results.append(kwargs),
+        fail_json=lambda msg, **kwargs: results.append(kwargs),
+    )
+    dataiku_utils.start_api_call_recording(module)
+
+    client = dataiku_utils.get_client_from_parsed_args(module, ["design"])
+    dataiku_utils.set_perf_phase(module, "read")
+    with pytest.raises(DataikuException):
+        client.get_user("alice").get_settings()
+    dataiku_utils.set_perf_phase(module, "diff")
+    dataiku_utils.set_perf_phase(module, "write")
+    client.create_user("alice", "password")
+    module.exit_json(changed=True)
+
+    perf = results[0]["perf"]
+    assert [(call["phase"], call["method"], call["path"], call["status"]) for call in perf["calls"]] == [
+        ("read", "GET", "/admin/users/{login}", 404),
+        ("write", "POST", "/admin/users/", 200),
+    ]
+    assert perf["calls"][1]["bytes_sent"] > 0 and perf["calls"][1]["bytes_received"] == 2
+    assert list(perf["phases"]) == ["bootstrap", "read", "diff", "write"]
+    assert perf["phases"]["read"]["calls"] == perf["phases"]["read"]["errors"] == 1
+    assert perf["phases"]["diff"]["calls"] == 0
+    assert perf["totals"]["calls"] == 2
+
+    # The client kept for the next module runs of the process stops recording with them
+    module._dss_perf = None
+    assert dataiku_utils.get_client_from_parsed_args(module, ["design"]) is client
+    client.get_user("alice").get_settings()
+    assert len(perf["calls"]) == 2